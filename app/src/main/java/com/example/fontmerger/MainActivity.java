@@ -2,9 +2,12 @@ package com.example.font;
 
 import android.os.Bundle;
 import android.os.Environment;
+import android.os.Handler;
+import android.os.Looper;
 import android.Manifest;
 import android.content.pm.PackageManager;
 import android.widget.Button;
+import android.widget.ProgressBar;
 import android.widget.TextView;
 import android.widget.Toast;
 import android.provider.Settings;
@@ -22,7 +25,17 @@ public class MainActivity extends AppCompatActivity {
     private static final int PERMISSION_REQUEST_CODE = 100;
     private static final int MANAGE_EXTERNAL_STORAGE_REQUEST_CODE = 101;
     
+    private static final long JOB_POLL_INTERVAL_MS = 250;
+
     private TextView logTextView;
+    private ProgressBar progressBar;
+    private Button mergeButton;
+    private Button cancelButton;
+
+    private final Handler handler = new Handler(Looper.getMainLooper());
+    private PyObject pyModule;
+    private String currentJobId;
+    private String lastStage;
 
     @Override
     protected void onCreate(Bundle savedInstanceState) {
@@ -35,7 +48,11 @@ public class MainActivity extends AppCompatActivity {
         }
 
         logTextView = findViewById(R.id.log_text_view);
-        Button mergeButton = findViewById(R.id.merge_button);
+        progressBar = findViewById(R.id.progress_bar);
+        mergeButton = findViewById(R.id.merge_button);
+        cancelButton = findViewById(R.id.cancel_button);
+        cancelButton.setEnabled(false);
+        cancelButton.setOnClickListener(v -> cancelMerge());
         
         log("تم تشغيل التطبيق. جارٍ التحقق من الصلاحيات...");
         
@@ -115,32 +132,106 @@ public class MainActivity extends AppCompatActivity {
     }
 
     private void startPythonScript() {
+        if (currentJobId != null) {
+            log("عملية دمج قيد التنفيذ بالفعل.");
+            return;
+        }
         log("جارٍ بدء عملية دمج الخطوط...");
+        mergeButton.setEnabled(false);
+        // تحميل الوحدة أول مرة بطيء، لذلك يتم الإرسال خارج خيط الواجهة
         new Thread(() -> {
             try {
-                Python py = Python.getInstance();
-                PyObject pyModule = py.getModule("font_merger_script");
-                
-                // Call the main function of the Python script with font names
+                if (pyModule == null) {
+                    pyModule = Python.getInstance().getModule("font_merger_script");
+                }
+
                 // These should be replaced by dynamic user input in a real app
                 String arabicFont = "arabic_font_name.ttf";
                 String englishFont = "english_font_name.ttf";
 
-                PyObject result = pyModule.callAttr("merge_fonts_android", arabicFont, englishFont);
-                final String logOutput = result.toString();
-                
+                // submit_merge يعود فوراً بمعرّف المهمة؛ التقدم يُقرأ بالاستطلاع
+                final String jobId = pyModule.callAttr("submit_merge", arabicFont, englishFont).toString();
                 runOnUiThread(() -> {
-                    log("اكتملت العملية.");
-                    log(logOutput);
+                    currentJobId = jobId;
+                    lastStage = null;
+                    progressBar.setProgress(0);
+                    cancelButton.setEnabled(true);
+                    handler.post(pollJob);
                 });
             } catch (Exception e) {
                 runOnUiThread(() -> {
+                    mergeButton.setEnabled(true);
                     log("حدث خطأ في سكربت بايثون:\n" + e.getMessage() + "\n" + e.toString());
                 });
             }
         }).start();
     }
-    
+
+    private final Runnable pollJob = new Runnable() {
+        @Override
+        public void run() {
+            if (currentJobId == null) {
+                return;
+            }
+            try {
+                PyObject status = pyModule.callAttr("get_job_status", currentJobId);
+                String state = status.callAttr("get", "status").toString();
+                // None في بايثون يصل كـ null
+                PyObject stageObj = status.callAttr("get", "stage");
+                String stage = stageObj == null ? null : stageObj.toString();
+                progressBar.setProgress(status.callAttr("get", "percent").toInt());
+                if (stage != null && !stage.equals(lastStage)) {
+                    lastStage = stage;
+                    log("المرحلة: " + stage);
+                }
+                if ("done".equals(state) || "failed".equals(state) || "cancelled".equals(state)) {
+                    log("اكتملت العملية.");
+                    log(status.callAttr("get", "result").toString());
+                    finishJob();
+                    return;
+                }
+            } catch (Exception e) {
+                log("تعذر قراءة حالة المهمة:\n" + e.getMessage());
+                finishJob();
+                return;
+            }
+            handler.postDelayed(this, JOB_POLL_INTERVAL_MS);
+        }
+    };
+
+    private void cancelMerge() {
+        if (currentJobId == null) {
+            return;
+        }
+        try {
+            pyModule.callAttr("cancel_job", currentJobId);
+            cancelButton.setEnabled(false);
+            log("جارٍ إلغاء عملية الدمج...");
+        } catch (Exception e) {
+            log("تعذر إلغاء المهمة:\n" + e.getMessage());
+        }
+    }
+
+    private void finishJob() {
+        currentJobId = null;
+        handler.removeCallbacks(pollJob);
+        mergeButton.setEnabled(true);
+        cancelButton.setEnabled(false);
+    }
+
+    @Override
+    protected void onDestroy() {
+        // لا داعي لإكمال دمج لن يراه أحد
+        handler.removeCallbacks(pollJob);
+        if (currentJobId != null && pyModule != null) {
+            try {
+                pyModule.callAttr("cancel_job", currentJobId);
+            } catch (Exception ignored) {
+            }
+        }
+        super.onDestroy();
+    }
+
     private void log(String message) {
         runOnUiThread(() -> {
             logTextView.append(message + "\n");
@@ -9,87 +9,471 @@ import sys
 import subprocess
 import time
 import traceback
+import errno
 import shutil
 import tempfile
-from fontTools.ttLib import TTFont
-try:
-    from fontTools.varLib.instancer import instantiateVariableFont
-except Exception:
-    try:
-        from fontTools.varLib.mutator import instantiateVariableFont
-    except Exception:
-        instantiateVariableFont = None
-
-from fontTools.merge import Merger
-from fontTools.subset import main as subset_main
-from PIL import Image, ImageDraw, ImageFont, features
-import arabic_reshaper
-from bidi.algorithm import get_display
-from colorama import init as colorama_init, Fore, Style
-from rich.progress import Progress, BarColumn, TextColumn, TimeRemainingColumn
-from rich.console import Console
-
-# محاولة استيراد harfbuzz و uharfbuzz
+import json
+import math
+import hashlib
+import unicodedata
+import io
+import mmap
+import queue
+import threading
+import atexit
+import uuid
+import contextlib
+import tracemalloc
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
 try:
-    import harfbuzz as hb
+    import resource
 except ImportError:
-    try:
-        import uharfbuzz as hb
-    except ImportError:
-        hb = None
+    resource = None
+
+# ---------- Lazy imports ----------
+# المكتبات الثقيلة (fontTools، Pillow، rich...) تُستورد عند أول مرحلة تحتاجها
+# وليس عند استيراد الملف، لتسريع تشغيل التطبيق (Chaquopy)
+class _LazyImport:
+    """وحدة (أو خاصية منها) تُستورد عند أول وصول لأي من خصائصها"""
+
+    def __init__(self, module, attr=None):
+        self._module = module
+        self._attr = attr
+        self._target = None
+
+    def _load(self):
+        if self._target is None:
+            target = importlib.import_module(self._module)
+            self._target = getattr(target, self._attr) if self._attr else target
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+fonttools = _LazyImport("fontTools")
+ttLib = _LazyImport("fontTools.ttLib")
+Image = _LazyImport("PIL.Image")
+ImageChops = _LazyImport("PIL.ImageChops")
+ImageColor = _LazyImport("PIL.ImageColor")
+ImageDraw = _LazyImport("PIL.ImageDraw")
+ImageFont = _LazyImport("PIL.ImageFont")
+features = _LazyImport("PIL.features")
+arabic_reshaper = _LazyImport("arabic_reshaper")
+colorama = _LazyImport("colorama")
+Fore = _LazyImport("colorama", "Fore")
+
+_OPTIONAL_MODULES = {}
+
+def _optional_import(*names):
+    """أول وحدة متاحة من names أو None؛ المحاولة تتم مرة واحدة"""
+    if names not in _OPTIONAL_MODULES:
+        module = None
+        for name in names:
+            try:
+                module = importlib.import_module(name)
+                break
+            except ImportError:
+                continue
+        _OPTIONAL_MODULES[names] = module
+    return _OPTIONAL_MODULES[names]
 
-colorama_init(autoreset=True)
+def _harfbuzz():
+    # harfbuzz أو uharfbuzz
+    return _optional_import("harfbuzz", "uharfbuzz")
 
 FONT_DIR = "/sdcard/fonts"
 TEMP_DIR = "/sdcard/fonts/temp_processing"
+# مجلد الملفات الوسيطة (None = مجلد النظام المؤقت: ذاكرة التطبيق الداخلية على Android، وغالباً tmpfs على Linux)
+# TEMP_DIR يعيد السلوك القديم: الملفات الوسيطة على /sdcard بجوار المدخلات
+SCRATCH_DIR = None
 EN_PREVIEW = "The quick brown fox jumps over the lazy dog. 1234567890"
 AR_PREVIEW = "سمَات مجّانِية، إختر منْ بين أكثر من ١٠٠ سمة مجانية او انشئ سماتك الخاصة هُنا في هذا التطبيق النظيف الرائع، وأظهر الابداع.١٢٣٤٥٦٧٨٩٠"
 
-# إنشاء المجلد المؤقت إذا لم يكن موجوداً
-os.makedirs(TEMP_DIR, exist_ok=True)
-
-# إنشاء المجلدات الفرعية
-os.makedirs(os.path.join(FONT_DIR, "previews"), exist_ok=True)
-os.makedirs(os.path.join(FONT_DIR, "merged"), exist_ok=True)
-os.makedirs(os.path.join(FONT_DIR, "logs"), exist_ok=True)
+# نطاقات الأحرف المحتفظ بها من كل خط
+ARABIC_UNICODES = ",".join([
+    "U+0600-06FF", "U+0750-077F", "U+08A0-08FF",
+    "U+FB50-FDFF", "U+FE70-FEFF", "U+0660-0669"
+])
+LATIN_UNICODES = "U+0020-007F"
+
+# توزيع نقاط الترميز بين الخطين: "coverage" = حسب cmap كل خط وسياسة COVERAGE_POLICY،
+# "ranges" = النطاقات الثابتة أعلاه لكل خط
+COVERAGE_MODE = "coverage"
+# قواعد الأولوية بالترتيب: (نطاقات، ترتيب الخطوط)؛ أول قاعدة تحوي نقطة الترميز تحدد مصدرها،
+# وهو أول خط في الترتيب يحتويها. نقاط خارج كل القواعد تُترك.
+COVERAGE_POLICY = (
+    (ARABIC_UNICODES + ",U+200C-200F,U+2066-2069", ("arabic", "english")),
+    ("U+0020-007E,U+00A0-024F,U+1E00-1EFF,U+2000-206F,U+20A0-20CF,U+2100-214F,U+2190-21FF,"
+     "U+2212,U+25CC,U+FEFF", ("english", "arabic")),
+)
+
+# ألوان المعاينات: الاسم -> (لون الخلفية، لون النص، لاحقة اسم الملف)
+PREVIEW_THEMES = {
+    "light": ("white", "black", ""),
+    "121212": ((18, 18, 18), "white", "_121212"),
+}
+DEFAULT_PREVIEW_THEMES = ("light", "121212")
+
+# ملفات المعاينة: الاسم -> الأبعاد والصيغة ولاحقة الاسم وخيارات الحفظ
+# الأحجام الأصغر تُشتق من رسم واحد بأكبر حجم مطلوب بدلاً من إعادة الرسم
+PREVIEW_PROFILES = {
+    "print": {"size": (6400, 2880), "format": "JPEG", "suffix": "",
+              "save": {"quality": 95, "dpi": (600, 600)}},
+    "screen": {"size": (1600, 720), "format": "WEBP", "suffix": "_screen",
+               "save": {"quality": 85}},
+    "thumb": {"size": (480, 216), "format": "JPEG", "suffix": "_thumb",
+              "save": {"quality": 80, "progressive": True, "optimize": True}},
+}
+DEFAULT_PREVIEW_PROFILES = ("print",)
+PREVIEW_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp"}
+# محرك تشكيل نص المعاينة: "auto" (Raqm إن وُجد، ثم HarfBuzz، ثم arabic_reshaper)
+# أو "raqm" | "harfbuzz" | "basic"
+PREVIEW_TEXT_ENGINE = "auto"
+# عينات التنعيم لكل محور عند رسم الحروف من مخططاتها في محرك HarfBuzz
+HB_SUPERSAMPLE = 4
+# عرض التخطيط المرجعي: ثوابت التخطيط بالبكسل مضبوطة على هذا العرض وتُحجَّم بنسبته
+PREVIEW_LAYOUT_WIDTH = 6400
+
+# الحد الأقصى لذاكرة العمل عند رسم المعاينة (بايت): إن لم تتسع الصور كاملة (عرض×ارتفاع×4 لكل نمط)
+# تُرسم على شرائح أفقية وتُكتب بكسلاتها غير المضغوطة في ملفات مؤقتة ثم تُقرأ للترميز
+# (~70MB كتابة وقراءة لكل نمط بحجم 6400x2880: ذاكرة أقل مقابل إدخال/إخراج كثير على الفلاش)
+# None = رسم الصورة كاملة في الذاكرة دائماً (~150MB للصورة 6400x2880)
+PREVIEW_MEMORY_LIMIT = 16 * 1024 * 1024
+
+# "files": كل مرحلة تقرأ وتكتب ملفاً | "memory": قراءة واحدة لكل خط والكتابة للناتج فقط
+PIPELINE_MODE = "files"
+# خطوط محضرة (مقلّصة ومحوّلة ومحجّمة) تبقى في ذاكرة العملية بين عمليات الدمج في وضع "memory"،
+# فيُحضَّر الخط العربي في fanout_merge مرة واحدة لكل unitsPerEm هدف (0 = تعطيل)
+PREPARED_MEMORY_MAX_BYTES = 64 * 1024 * 1024
+
+# موضع تثبيت الخطوط المتغيرة قبل المعالجة: None = القيم الافتراضية للمحاور،
+# أو {"wght": 700} أو "wght=700,wdth=90" أو اسم نسخة مسماة مثل "Bold"
+VARIABLE_INSTANCE = None
+
+# ذاكرة التخزين المؤقت للملفات الوسيطة (تحويل، توحيد الوحدات، التقليص)
+# None = مجلد "cache" داخل scratch_dir() (ذاكرة التطبيق الداخلية على Android، لا /sdcard المشترك)
+CACHE_DIR = None
+CACHE_ENABLED = True
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+CACHE_VERSION = 1
+
+# فهرس مكتبة الخطوط (SQLite): بيانات كل خط تُقرأ مرة واحدة لكل (مسار، وقت تعديل، حجم)
+# None = font_index.sqlite في cache_dir()
+FONT_INDEX_PATH = None
+FONT_EXTENSIONS = (".ttf", ".otf")
+# أدنى نسبة من الحروف الأساسية ليُعد الخط داعماً للعربية/اللاتينية في list_fonts
+FONT_INDEX_MIN_COVERAGE = 0.9
+
+# فحص مسبق سريع (فهرس الجداول وجداول صغيرة) يرفض الدمج المستحيل قبل المراحل المكلفة
+PREFLIGHT_ENABLED = True
+
+# سجل الدمج المكتملة: طلب مكرر (نفس الملفات والخيارات) يُعيد الناتج الموجود
+MERGE_CATALOG_ENABLED = True
+MERGE_CATALOG_PATH = os.path.join(FONT_DIR, "merge_catalog.sqlite")
+
+# محوّل CFF إلى TrueType: "native" (fontTools داخل العملية) أو "fontforge"
+CFF_CONVERTER = "native"
+# أقصى خطأ مسموح عند تقريب المنحنيات التكعيبية بتربيعية (بوحدات خط 1000 em)
+CU2QU_MAX_ERR = 1.0
+
+# عملية FontForge دائمة تستقبل مهام التحويل والدمج بدل تشغيل عملية لكل مهمة
+FONTFORGE_WORKER_ENABLED = True
+FONTFORGE_TIMEOUT = 120
+
+# محرك الدمج: "fonttools" (fontTools.merge داخل العملية) أو "fontforge"
+MERGE_ENGINE = "fonttools"
+# تجربة FontForge إذا فشل دمج fontTools (يتطلب وجود fontforge)
+MERGE_FONTFORGE_FALLBACK = False
+
+# تحسين حجم الخط الناتج بعد الدمج: تقليص مع إغلاق GSUB، حذف الجداول والأسماء غير اللازمة
+OUTPUT_OPTIMIZE = False
+# نسخة WOFF2 بجوار ملف TTF (تتطلب brotli)
+OUTPUT_WOFF2 = False
+OUTPUT_DROP_TABLES = ("DSIG", "hdmx", "LTSH", "VDMX", "PCLT", "JSTF")
+# سجلات جدول name المحتفظ بها (العائلة، النمط، المعرف، الاسم الكامل، الإصدار، اسم PostScript)
+OUTPUT_NAME_IDS = (0, 1, 2, 3, 4, 5, 6)
+# أسماء الحروف في جدول post (False = post 3.0 بلا أسماء)
+OUTPUT_GLYPH_NAMES = False
+
+# مجلد المعالجة الخاص بكل عامل في وضع الدفعات (None = scratch_dir())
+WORKER_TEMP_DIR = None
+
+# قياسات كل مرحلة (زمن، معالج، ذاكرة، قراءة/كتابة) في ملف JSON بجوار السجل
+METRICS_ENABLED = True
+# تتبع ذروة ذاكرة بايثون بـ tracemalloc (يبطئ الدمج بشكل ملحوظ)
+METRICS_TRACEMALLOC = False
+# تحديث ملخص تراكمي لكل التشغيلات بعد كل دمج (logs/metrics_summary.json)
+METRICS_SUMMARY = False
+# عدد ملفات القياس المحتفظ بها في مجلد السجلات (الأقدم يُحذف)
+METRICS_MAX_FILES = 200
+
+# السجل: سجلات مستوياتٍ تُجمَّع في الذاكرة وتُكتب دفعةً من خيط في الخلفية
+LOG_DIR = os.path.join(FONT_DIR, "logs")
+LOG_LEVEL = "INFO"
+# "jsonl": سجل JSON لكل سطر | "text": "الوقت المستوى الرسالة"
+LOG_FORMAT = "jsonl"
+LOG_FLUSH_INTERVAL = 0.5
+LOG_BUFFER_RECORDS = 512
+# تدوير الملف عند تجاوز الحجم، مع الاحتفاظ بعدد محدود من النسخ القديمة
+LOG_MAX_BYTES = 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+# أقصى زمن مسموح لاستيراد هذا الملف (انظر check_import_time)
+IMPORT_TIME_BUDGET_MS = 150
 
 # ---------- Logging ----------
-def get_unique_log_path():
-    """الحصول على مسار فريد لملف السجل"""
-    base_name = "merge_log"
-    counter = 1
-    log_file = os.path.join(FONT_DIR, "logs", f"{base_name}.txt")
-    while os.path.exists(log_file):
-        log_file = os.path.join(FONT_DIR, "logs", f"{base_name}_{counter}.txt")
-        counter += 1
-    return log_file
-
-LOG_FILE = get_unique_log_path()
-
-def write_log_line(line):
-    """كتابة سجل بدون timestamp"""
-    try:
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(f"{line}\n")
-    except Exception as e:
-        print(f"{Fore.RED}Failed to write to log file: {e}")
+LOG_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40, "CRITICAL": 50}
+# بادئات الرسائل القديمة -> المستوى
+_LOG_PREFIX_LEVELS = {"[WARN]": "WARNING", "[ERROR]": "ERROR", "[FATAL]": "CRITICAL", "[CANCELLED]": "INFO"}
+
+class LogWriter:
+    """سجل مخزَّن مؤقتاً مع تدوير بالحجم
+
+    ``emit`` only appends a tuple to an in-memory list (no syscalls, no
+    formatting), so it is safe to call from hot loops. A daemon thread
+    formats and appends the buffered records every ``LOG_FLUSH_INTERVAL``
+    seconds, or as soon as ``LOG_BUFFER_RECORDS`` are waiting, with one
+    ``open``/``write`` per batch. Before a record would push the file past
+    ``LOG_MAX_BYTES`` it is rotated to ``name.1.ext`` ... keeping
+    ``LOG_BACKUP_COUNT`` old files. Only the main process rotates: forked
+    children and the workers of the stage and batch pools (which under
+    spawn import this module afresh, see ``_pool_worker_init``) have
+    ``rotate`` off, just append (O_APPEND) and must call ``flush`` before
+    exiting.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._records = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._size = None
+        self.rotate = True
+
+    def emit(self, level, msg, **fields):
+        with self._lock:
+            self._records.append((time.time(), level, msg, fields))
+            pending = len(self._records)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+        if pending >= LOG_BUFFER_RECORDS:
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(LOG_FLUSH_INTERVAL)
+            self._wake.clear()
+            self.flush()
+
+    def after_fork(self):
+        # الخيط لا ينتقل إلى العملية الابنة، والسجلات المنسوخة تخص الأب
+        self._records = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._size = None
+        self.rotate = False
+
+    def _format(self, record):
+        ts, level, msg, fields = record
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts)) + f".{int(ts * 1000) % 1000:03d}"
+        if LOG_FORMAT == "text":
+            return f"{stamp} {level:<8} {msg}\n"
+        return json.dumps(dict({"ts": stamp, "level": level, "msg": msg, "pid": os.getpid()}, **fields),
+                          ensure_ascii=False) + "\n"
+
+    def _rotate(self):
+        base, ext = os.path.splitext(self.path)
+        for i in range(LOG_BACKUP_COUNT - 1, 0, -1):
+            src = f"{base}.{i}{ext}"
+            if os.path.exists(src):
+                os.replace(src, f"{base}.{i + 1}{ext}")
+        if LOG_BACKUP_COUNT > 0:
+            os.replace(self.path, f"{base}.1{ext}")
+        else:
+            os.remove(self.path)
+        self._size = 0
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                records, self._records = self._records, []
+            if not records:
+                return
+            rotate = self.rotate
+            try:
+                if self._size is None:
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    self._size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+                chunk, chunk_size = [], 0
+                for record in records:
+                    line = self._format(record).encode("utf-8")
+                    if rotate and self._size + chunk_size + len(line) > LOG_MAX_BYTES and self._size + chunk_size:
+                        self._append(chunk, chunk_size)
+                        self._rotate()
+                        chunk, chunk_size = [], 0
+                    chunk.append(line)
+                    chunk_size += len(line)
+                self._append(chunk, chunk_size)
+            except OSError as e:
+                print(f"{Fore.RED}Failed to write to log file: {e}")
+
+    def _append(self, chunk, size):
+        if chunk:
+            with open(self.path, "ab") as f:
+                f.write(b"".join(chunk))
+            self._size += size
+
+LOG_FILE = os.path.join(LOG_DIR, "merge_log" + (".txt" if LOG_FORMAT == "text" else ".jsonl"))
+_LOG_WRITER = LogWriter(LOG_FILE)
+atexit.register(lambda: _LOG_WRITER.flush())
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=lambda: _LOG_WRITER.after_fork())
+
+def write_log_line(line, level=None):
+    """إضافة سجل (بمستوى من بادئة [WARN]/[ERROR]/... إن لم يُحدد)
+
+    Records carry a timestamp, level, pid, and the current job and metrics
+    run ids.
+    """
+    if level is None:
+        level = "INFO"
+        if line.startswith("["):
+            prefix, _, rest = line.partition(" ")
+            if prefix in _LOG_PREFIX_LEVELS:
+                level, line = _LOG_PREFIX_LEVELS[prefix], rest
+    if LOG_LEVELS.get(level, 20) < LOG_LEVELS.get(LOG_LEVEL, 20):
+        return
+    fields = {}
+    job = current_job()
+    if job is not None:
+        fields["job"] = job.id
+    metrics = current_metrics()
+    if metrics is not None:
+        fields["run"] = metrics.record["id"]
+    _LOG_WRITER.emit(level, line, **fields)
+
+def flush_log():
+    """كتابة السجلات المعلّقة فوراً (قبل خروج عملية أو قراءة السجل)"""
+    _LOG_WRITER.flush()
 
 def write_log_header():
-    """كتابة رأس السجل بالوقت والتاريخ"""
-    ts = time.strftime("%Y-%m-%d %I:%M:%S %p")
-    try:
-        with open(LOG_FILE, "w", encoding="utf-8") as f:
-            f.write(f"{ts} - بدء دمج الخطوط\n")
-    except Exception as e:
-        print(f"{Fore.RED}Failed to create log file: {e}")
+    """سجل بداية دمج جديد (لم يعد الملف يُفرَّغ؛ التدوير يحدد حجمه)"""
+    write_log_line("بدء دمج الخطوط", level="INFO")
+
+# ---------- Startup ----------
+_RUNTIME_READY = False
+
+def init_runtime():
+    """إنشاء مجلدات العمل وتهيئة ألوان الطرفية عند أول دمج (لا شيء يحدث عند الاستيراد)"""
+    global _RUNTIME_READY
+    if _RUNTIME_READY:
+        return
+    colorama.init(autoreset=True)
+    for path in (os.path.join(FONT_DIR, "previews"), os.path.join(FONT_DIR, "merged"),
+                 LOG_DIR, cache_dir()):
+        os.makedirs(path, exist_ok=True)
+    _RUNTIME_READY = True
+
+# وحدات لا يجب أن يستوردها "import font_merger_script"
+_HEAVY_MODULES = ("fontTools", "PIL", "arabic_reshaper", "bidi", "colorama", "rich",
+                  "harfbuzz", "uharfbuzz")
+
+def check_import_time(budget_ms=None):
+    """قياس زمن استيراد هذا الملف في عملية جديدة (python -X importtime)
+
+    Raises ``RuntimeError`` when the import takes longer than ``budget_ms``
+    (default ``IMPORT_TIME_BUDGET_MS``) or pulls in any of the heavy
+    dependencies, which must only load on first use. Returns the measured
+    time in milliseconds.
+    """
+    budget_ms = IMPORT_TIME_BUDGET_MS if budget_ms is None else budget_ms
+    module = os.path.splitext(os.path.basename(__file__))[0]
+    probe = (f"import sys, {module}; "
+             f"print(','.join(sorted(m for m in sys.modules if m.split('.')[0] in {_HEAVY_MODULES!r})))")
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    # الاستيراد الأول يكتب ملف .pyc فلا يُحسب زمن الترجمة (Chaquopy يشحن ملفات مترجمة)
+    for _ in range(2):
+        res = subprocess.run([sys.executable, "-X", "importtime", "-c", probe],
+                             cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                             capture_output=True, text=True, timeout=60)
+    if res.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed: {res.stderr.strip()[-500:]}")
+    took_us = None
+    for line in res.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            took_us = int(parts[1])
+    if took_us is None:
+        raise RuntimeError(f"No -X importtime entry for {module}")
+    took_ms = took_us / 1000.0
+    loaded = res.stdout.strip()
+    if loaded:
+        raise RuntimeError(f"Importing {module} loaded heavy modules: {loaded}")
+    if took_ms > budget_ms:
+        raise RuntimeError(f"Importing {module} took {took_ms:.1f}ms (budget {budget_ms}ms)")
+    return took_ms
 
 # ---------- Utilities ----------
-def copy_to_temp(src_path, temp_dir):
-    """نسخ الملف إلى المجلد المؤقت"""
-    filename = os.path.basename(src_path)
-    dst_path = os.path.join(temp_dir, filename)
-    shutil.copy2(src_path, dst_path)
-    return dst_path
+def scratch_dir():
+    """مجلد الملفات الوسيطة (SCRATCH_DIR أو مجلد النظام المؤقت)"""
+    path = SCRATCH_DIR or os.path.join(tempfile.gettempdir(), "font_merger")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def cache_dir():
+    """مجلد الكاش (CACHE_DIR أو مجلد cache داخل scratch_dir())"""
+    path = CACHE_DIR or os.path.join(scratch_dir(), "cache")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def open_font_mapped(path, **kwargs):
+    """فتح الخط فوق mmap للقراءة فقط بدل نسخه أو قراءته كاملاً
+
+    fontTools reads tables through ``seek``/``read`` on the mapping, so only
+    the pages of the tables actually used are touched. The mapping is closed
+    with the font. Empty files cannot be mapped and are opened normally.
+    """
+    with open(path, "rb") as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            return ttLib.TTFont(path, **kwargs)
+    return ttLib.TTFont(mapped, **kwargs)
+
+def publish_file(src, dst):
+    """نشر ناتج نهائي دفعة واحدة: إعادة تسمية ذرية، أو نسخة متدفقة واحدة عند اختلاف نظام الملفات
+
+    Across file systems (scratch on internal storage, outputs on /sdcard)
+    the file is copied once to ``dst + ".part"`` next to the destination and
+    renamed over ``dst``, so readers never see a partial file. ``src`` is
+    removed either way.
+    """
+    try:
+        os.replace(src, dst)
+        return dst
+    except OSError as ex:
+        if ex.errno != errno.EXDEV:
+            raise
+    part = dst + ".part"
+    try:
+        shutil.copyfile(src, part)
+        os.replace(part, dst)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(part)
+        raise
+    os.remove(src)
+    return dst
 
 def shutil_which(cmd):
     try:
@@ -98,178 +482,1518 @@ def shutil_which(cmd):
     except Exception:
         return None
 
-def has_cff(path):
+# ---------- Cancellation and progress ----------
+class MergeCancelled(RuntimeError):
+    """أُلغيت مهمة الدمج الجارية (انظر cancel_job)"""
+
+# المهمة التي يعمل عليها الخيط الحالي (تُضبط في _run_job)
+_JOB_CONTEXT = threading.local()
+
+def current_job():
+    return getattr(_JOB_CONTEXT, "job", None)
+
+def cancel_requested():
+    job = current_job()
+    return job is not None and job.cancel_event.is_set()
+
+def check_cancelled():
+    """نقطة فحص: رفع MergeCancelled إن أُلغيت مهمة الخيط الحالي"""
+    if cancel_requested():
+        raise MergeCancelled(f"Job {current_job().id} cancelled")
+
+def report_progress(stage, stage_percent, percent=None):
+    """إبلاغ مهمة الخيط الحالي بالتقدم ثم فحص الإلغاء (لا شيء خارج المهام)"""
+    job = current_job()
+    if job is not None:
+        job.update_progress(stage, stage_percent, percent)
+        check_cancelled()
+
+def run_subprocess(cmd, timeout=120):
+    """مثل subprocess.run(capture, text) لكن يُنهي العملية فور إلغاء المهمة
+
+    Raises ``subprocess.TimeoutExpired`` like ``subprocess.run`` and
+    ``MergeCancelled`` when the calling job is cancelled; in both cases the
+    child is killed first.
+    """
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    deadline = time.time() + timeout
+    while True:
+        try:
+            out, err = proc.communicate(timeout=0.25)
+            return subprocess.CompletedProcess(cmd, proc.returncode, out, err)
+        except subprocess.TimeoutExpired:
+            if cancel_requested() or time.time() >= deadline:
+                proc.kill()
+                proc.communicate()
+                check_cancelled()
+                raise subprocess.TimeoutExpired(cmd, timeout)
+
+# ---------- Instrumentation ----------
+# قياسات التشغيل الحالي في هذا الخيط (تُضبط في main_merge)
+_METRICS_CONTEXT = threading.local()
+
+def current_metrics():
+    return getattr(_METRICS_CONTEXT, "metrics", None)
+
+def _read_proc_counters(path, fields):
     try:
-        f = TTFont(path)
-        keys = f.keys()
-        return ("CFF " in keys) or ("CFF2" in keys)
-    except Exception:
+        with open(path, "r") as f:
+            values = dict(line.split(":", 1) for line in f if ":" in line)
+        return {k: int(values[k].split()[0]) for k in fields if k in values}
+    except (OSError, ValueError):
+        return {}
+
+def _reset_peak_rss():
+    """تصفير VmHWM حتى تعبّر ذروة الذاكرة عن المرحلة وحدها (Linux فقط)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def _child_process_times():
+    """زمن معالج العمليات الفرعية: المنتهية (rusage) وعامل FontForge الحي"""
+    total = 0.0
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        total += usage.ru_utime + usage.ru_stime
+    worker = _FONTFORGE_WORKER
+    proc = worker.proc if worker is not None else None
+    if proc is not None:
+        try:
+            with open(f"/proc/{proc.pid}/stat", "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except (OSError, ValueError, IndexError):
+            pass
+    return total
+
+def _metrics_sample():
+    io_counts = _read_proc_counters("/proc/self/io", ("rchar", "wchar"))
+    return {
+        "wall": time.perf_counter(),
+        "cpu": time.process_time(),
+        "children_cpu": _child_process_times(),
+        "read": io_counts.get("rchar"),
+        "written": io_counts.get("wchar"),
+    }
+
+class RunMetrics:
+    """قياسات مراحل دمج واحد
+
+    ``stage(name)`` is a context manager that records wall time, CPU time
+    of this process, CPU time of child processes (FontForge, stage pools),
+    peak RSS (VmHWM, reset per stage where the kernel allows it), peak
+    Python allocations when ``METRICS_TRACEMALLOC`` is on, and bytes read
+    and written (``/proc/self/io`` rchar/wchar). Values that the platform
+    cannot provide are ``None``. Stages run by ``StageScheduler`` are added
+    as substages of the enclosing stage. ``finish`` writes the record as
+    JSON next to the log file.
+    """
+
+    def __init__(self, arabic, english, pipeline):
+        self.record = {
+            "id": uuid.uuid4().hex,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "arabic": arabic,
+            "english": english,
+            "pipeline": pipeline,
+            "stages": [],
+        }
+        # إصابات/إخفاقات الكاش لهذا الدمج وحده (انظر _CACHE_CONTEXT)
+        self.cache = {"hits": 0, "misses": 0}
+        self.enabled = METRICS_ENABLED
+        self._current = None
+        self._started = _metrics_sample()
+        self._tracing = self.enabled and METRICS_TRACEMALLOC and not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        entry = {"name": name}
+        if not self.enabled:
+            yield entry
+            return
+        self.record["stages"].append(entry)
+        parent, self._current = self._current, entry
+        hwm_reset = _reset_peak_rss()
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        before = _metrics_sample()
+        try:
+            yield entry
+        finally:
+            after = _metrics_sample()
+            self._current = parent
+            for key in ("wall", "cpu", "children_cpu", "read", "written"):
+                if before[key] is None or after[key] is None:
+                    entry[key] = None
+                elif key in ("read", "written"):
+                    entry[key] = after[key] - before[key]
+                else:
+                    entry[key] = round(after[key] - before[key], 4)
+            status = _read_proc_counters("/proc/self/status", ("VmHWM", "VmRSS"))
+            # بدون تصفير VmHWM تكون الذروة هي ذروة العملية منذ بدايتها
+            entry["peak_rss"] = status["VmHWM"] * 1024 if "VmHWM" in status else None
+            entry["peak_rss_scope"] = "stage" if hwm_reset else "process"
+            entry["rss"] = status["VmRSS"] * 1024 if "VmRSS" in status else None
+            entry["peak_traced"] = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+            write_log_line(f"Metrics {name}: wall {entry['wall']:.3f}s, cpu {entry['cpu']:.3f}s, "
+                           f"children {entry['children_cpu']:.3f}s, "
+                           f"peak RSS {_format_bytes(entry['peak_rss'])}, "
+                           f"read {_format_bytes(entry['read'])}, written {_format_bytes(entry['written'])}")
+
+    def add_substages(self, timings, busy, kinds):
+        """أزمنة مراحل StageScheduler داخل المرحلة الجارية"""
+        if not self.enabled or self._current is None:
+            return
+        subs = self._current.setdefault("substages", [])
+        for name in timings:
+            subs.append({"name": name, "kind": kinds.get(name),
+                         "wall": round(timings[name], 4), "busy": round(busy.get(name, 0.0), 4)})
+
+    def finish(self, result):
+        if not self.enabled:
+            return None
+        ended = _metrics_sample()
+        self.record["result"] = result
+        self.record["wall"] = round(ended["wall"] - self._started["wall"], 4)
+        self.record["cpu"] = round(ended["cpu"] - self._started["cpu"], 4)
+        self.record["children_cpu"] = round(ended["children_cpu"] - self._started["children_cpu"], 4)
+        self.record["cache"] = dict(self.cache)
+        if self._tracing:
+            tracemalloc.stop()
+        path = metrics_path(self.record)
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(self.record, f, ensure_ascii=False, indent=1)
+            _prune_metrics(os.path.dirname(path))
+        except OSError as ex:
+            write_log_line(f"[WARN] Writing metrics failed: {ex}")
+            return None
+        if METRICS_SUMMARY:
+            try:
+                summarize_metrics()
+            except Exception as ex:
+                write_log_line(f"[WARN] Metrics summary failed: {ex}")
+        return path
+
+def _format_bytes(n):
+    if n is None:
+        return "n/a"
+    return f"{n / (1024 * 1024):.1f}MB"
+
+def metrics_path(record):
+    stamp = record["started"].replace("-", "").replace(":", "")
+    return os.path.join(LOG_DIR, f"run_{stamp}_{record['id'][:8]}_metrics.json")
+
+def _prune_metrics(log_dir):
+    # الأسماء تبدأ بوقت التشغيل، فالترتيب الأبجدي ترتيب زمني
+    names = sorted(n for n in os.listdir(log_dir) if n.startswith("run_") and n.endswith("_metrics.json"))
+    for name in names[:max(0, len(names) - METRICS_MAX_FILES)]:
+        try:
+            os.remove(os.path.join(log_dir, name))
+        except OSError:
+            pass
+
+def summarize_metrics(log_dir=None, out_path=None):
+    """ملخص تراكمي لكل ملفات القياس في مجلد السجلات
+
+    Aggregates every ``*_metrics.json`` in ``log_dir`` per pipeline and
+    stage (runs, total/mean/min/max wall and CPU, child CPU, max peak RSS,
+    bytes read/written) and writes it to ``out_path`` (default
+    ``logs/metrics_summary.json``). Returns the summary dict.
+    """
+    log_dir = log_dir or LOG_DIR
+    out_path = out_path or os.path.join(log_dir, "metrics_summary.json")
+    summary = {"runs": 0, "results": {}, "pipelines": {}}
+    for name in sorted(os.listdir(log_dir)):
+        if not name.endswith("_metrics.json"):
+            continue
+        try:
+            with open(os.path.join(log_dir, name), "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            continue
+        summary["runs"] += 1
+        result = (record.get("result") or "").split(":", 1)[0]
+        summary["results"][result] = summary["results"].get(result, 0) + 1
+        stages = summary["pipelines"].setdefault(record.get("pipeline") or "", {})
+        rows = list(record.get("stages", []))
+        if "wall" in record:
+            rows.append(dict(record, name="total"))
+        for stage in rows:
+            agg = stages.setdefault(stage["name"], {
+                "runs": 0, "wall_total": 0.0, "wall_min": None, "wall_max": 0.0,
+                "cpu_total": 0.0, "children_cpu_total": 0.0, "peak_rss_max": None,
+                "read_total": 0, "written_total": 0,
+            })
+            wall = stage.get("wall") or 0.0
+            agg["runs"] += 1
+            agg["wall_total"] += wall
+            agg["wall_min"] = wall if agg["wall_min"] is None else min(agg["wall_min"], wall)
+            agg["wall_max"] = max(agg["wall_max"], wall)
+            agg["cpu_total"] += stage.get("cpu") or 0.0
+            agg["children_cpu_total"] += stage.get("children_cpu") or 0.0
+            if stage.get("peak_rss") is not None:
+                agg["peak_rss_max"] = max(agg["peak_rss_max"] or 0, stage["peak_rss"])
+            agg["read_total"] += stage.get("read") or 0
+            agg["written_total"] += stage.get("written") or 0
+    for stages in summary["pipelines"].values():
+        for agg in stages.values():
+            agg["wall_mean"] = agg["wall_total"] / agg["runs"]
+            agg["cpu_mean"] = agg["cpu_total"] / agg["runs"]
+            for key in ("wall_total", "wall_min", "wall_max", "wall_mean", "cpu_total", "cpu_mean",
+                        "children_cpu_total"):
+                agg[key] = round(agg[key], 4)
+    tmp = out_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, out_path)
+    return summary
+
+# ---------- Stage scheduler ----------
+# مراحل fontTools الثقيلة على المعالج تعمل في عمليات منفصلة (False = خيوط فقط)
+STAGE_PROCESSES = True
+STAGE_MAX_PROCESSES = 2
+
+def _fonttools_stage_kind():
+    """عمليات لتحويل CFF الأصلي (fontTools)، وخيوط عندما يكون FontForge هو المحوّل"""
+    return "process" if CFF_CONVERTER == "native" else "thread"
+
+def _run_stage_in_process(fn, args):
+    """المرحلة داخل عملية فرعية: (النتيجة، زمن التنفيذ، إحصاءات الكاش)"""
+    stats = _CACHE_CONTEXT.stats = {"hits": 0, "misses": 0}
+    started = time.perf_counter()
+    try:
+        result = fn(*args)
+    finally:
+        _CACHE_CONTEXT.stats = None
+        # عمليات المجمّع تنتهي دون atexit
+        flush_log()
+    return result, time.perf_counter() - started, stats
+
+def _run_stage_in_thread(job, stats, fn, args):
+    """المرحلة في خيط: تُربط بمهمة المستدعي وعدّادات كاشه لتعمل نقاط فحص الإلغاء والإحصاءات"""
+    _JOB_CONTEXT.job = job
+    _CACHE_CONTEXT.stats = stats
+    started = time.perf_counter()
+    try:
+        return fn(*args), time.perf_counter() - started, None
+    finally:
+        _JOB_CONTEXT.job = None
+        _CACHE_CONTEXT.stats = None
+
+def _pool_worker_init():
+    # عامل في مجمّع عمليات: يكتب في السجل دون تدويره، فالتدوير للعملية الرئيسية وحدها
+    _LOG_WRITER.rotate = False
+
+def _pool_context():
+    """سياق spawn على أندرويد: fork من عملية فيها خيوط غير آمن هناك"""
+    if hasattr(sys, "getandroidapilevel") or "ANDROID_ROOT" in os.environ:
+        return multiprocessing.get_context("spawn")
+    return None
+
+_STAGE_POOL = None
+_STAGE_POOL_LOCK = threading.Lock()
+
+def get_stage_pool():
+    """مجمّع عمليات المراحل المشترك: يُنشأ عند أول استخدام ويُعاد استخدامه (أو None)
+
+    Starting a pool costs a fork, or under spawn (Android) a full
+    interpreter start and module import per worker, which is more than the
+    stage work for typical fonts; so every ``StageScheduler`` in the process
+    submits to this one pool. A pool broken by a crashed worker is replaced.
+    The pool is shut down at exit or by ``shutdown_stage_pool``.
+    """
+    global _STAGE_POOL
+    if not STAGE_PROCESSES:
+        return None
+    with _STAGE_POOL_LOCK:
+        if _STAGE_POOL is not None and getattr(_STAGE_POOL, "_broken", False):
+            _STAGE_POOL.shutdown(wait=False)
+            _STAGE_POOL = None
+        if _STAGE_POOL is None:
+            try:
+                _STAGE_POOL = ProcessPoolExecutor(max_workers=STAGE_MAX_PROCESSES, mp_context=_pool_context(),
+                                                  initializer=_pool_worker_init)
+            except (ImportError, NotImplementedError, OSError) as ex:
+                write_log_line(f"[WARN] Process pool unavailable ({ex}), running stages on threads")
+                return None
+        return _STAGE_POOL
+
+def shutdown_stage_pool():
+    global _STAGE_POOL
+    with _STAGE_POOL_LOCK:
+        pool, _STAGE_POOL = _STAGE_POOL, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+atexit.register(shutdown_stage_pool)
+
+class StageScheduler:
+    """تشغيل مراحل مستقلة بالتوازي حسب اعتمادياتها
+
+    ``add(name, fn, args, deps, kind)`` registers a stage. ``args`` is a
+    tuple, or a callable that receives the results dict and returns the
+    tuple once all ``deps`` have finished. ``kind`` is ``"thread"`` for
+    subprocess-bound work (FontForge) and ``"process"`` for CPU-bound
+    fontTools work; process stages run on threads when ``STAGE_PROCESSES``
+    is off or no process pool is available (Chaquopy). ``on_done`` is called
+    in the caller's thread as each stage finishes; wall times are logged and
+    kept in ``timings``. A failing stage fails ``run`` with its exception.
+    """
+
+    def __init__(self, on_done=None):
+        self.on_done = on_done or (lambda name: None)
+        self.stages = {}
+        self.results = {}
+        self.timings = {}
+        self.busy = {}
+        self.kinds = {}
+
+    def add(self, name, fn, args=(), deps=(), kind="thread"):
+        self.stages[name] = (fn, args, tuple(deps), kind)
+        return name
+
+    def _process_pool(self):
+        if not any(s[3] == "process" for s in self.stages.values()):
+            return None
+        return get_stage_pool()
+
+    def run(self):
+        job = current_job()
+        cache_stats = current_cache_stats()
+        threads = ThreadPoolExecutor(max_workers=max(1, len(self.stages)), thread_name_prefix="stage")
+        processes = self._process_pool()
+        pending = list(self.stages)
+        running = {}
+        started_all = time.perf_counter()
+        try:
+            while pending or running:
+                for name in [n for n in pending if all(d in self.results for d in self.stages[n][2])]:
+                    pending.remove(name)
+                    fn, args, _, kind = self.stages[name]
+                    if callable(args):
+                        args = args(self.results)
+                    if kind == "process" and processes is not None:
+                        fut = processes.submit(_run_stage_in_process, fn, args)
+                    else:
+                        fut = threads.submit(_run_stage_in_thread, job, cache_stats, fn, args)
+                        kind = "thread"
+                    running[fut] = (name, kind, time.perf_counter())
+                if not running:
+                    raise RuntimeError(f"Stages with unmet dependencies: {', '.join(pending)}")
+                done, _ = wait(running, timeout=0.25, return_when=FIRST_COMPLETED)
+                check_cancelled()
+                for fut in done:
+                    name, kind, started = running.pop(fut)
+                    result, busy, stats = fut.result()
+                    add_cache_stats(cache_stats, stats)
+                    self.results[name] = result
+                    self.timings[name] = time.perf_counter() - started
+                    self.busy[name] = busy
+                    self.kinds[name] = kind
+                    write_log_line(f"Stage {name}: {self.timings[name]:.3f}s ({kind}, busy {busy:.3f}s)")
+                    self.on_done(name)
+        finally:
+            # المجمّع مشترك: تُلغى مراحل هذا التشغيل التي لم تبدأ، وما بدأ منها ينتهي في الخلفية
+            for fut in running:
+                fut.cancel()
+            threads.shutdown(wait=True, cancel_futures=True)
+        write_log_line(f"Stages: {len(self.stages)} in {time.perf_counter() - started_all:.3f}s "
+                       f"(serial work {sum(self.busy.values()):.3f}s)")
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.add_substages(self.timings, self.busy, self.kinds)
+        return self.results
+
+# ---------- Font index ----------
+FONT_INDEX_VERSION = 2
+_FONT_INDEX_LOCK = threading.Lock()
+# الحروف الأساسية لقياس التغطية: حروف الهجاء العربية، وحروف ASCII المطبوعة
+_ARABIC_LETTERS = tuple(range(0x0621, 0x063B)) + tuple(range(0x0641, 0x064B))
+_LATIN_LETTERS = tuple(range(0x0020, 0x007F))
+
+def _unicode_ranges(spec):
+    """تحليل نطاقات مثل "U+0600-06FF,U+0660" إلى [(0x600, 0x6FF), (0x660, 0x660)]"""
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip().upper().replace("U+", "")
+        if not part:
+            continue
+        lo, _, hi = part.partition("-")
+        ranges.append((int(lo, 16), int(hi or lo, 16)))
+    return ranges
+
+def _format_unicode_ranges(codepoints):
+    """عكس _unicode_ranges: نقاط ترميز -> "U+0600-06FF,U+0660" (مصفوفة مرتبة مضغوطة في نطاقات)"""
+    parts = []
+    start = prev = None
+    for cp in sorted(codepoints):
+        if prev is not None and cp == prev + 1:
+            prev = cp
+            continue
+        if start is not None:
+            parts.append(f"U+{start:04X}" if start == prev else f"U+{start:04X}-{prev:04X}")
+        start = prev = cp
+    if start is not None:
+        parts.append(f"U+{start:04X}" if start == prev else f"U+{start:04X}-{prev:04X}")
+    return ",".join(parts)
+
+def read_font_info(path):
+    """بيانات الخط من الجداول اللازمة فقط (name، head، maxp، cmap، OS/2، fvar)
+
+    The font is opened lazily, so only those tables are decompiled; the
+    outline format comes from the table directory. Coverage is the share of
+    the basic Arabic letters / printable ASCII present in the cmap, and
+    ``arabic_chars``/``latin_chars`` count the mapped code points in
+    ``ARABIC_UNICODES``/``LATIN_UNICODES``. ``unicodes`` is the whole cmap
+    as compact ranges.
+    """
+    font = open_font_mapped(path, lazy=True)
+    try:
+        name = font["name"]
+        cmap = font.getBestCmap() or {}
+        if "CFF2" in font:
+            outline = "CFF2"
+        elif "CFF " in font:
+            outline = "CFF"
+        else:
+            outline = "glyf" if "glyf" in font else None
+        axes = []
+        if "fvar" in font:
+            axes = [{"tag": a.axisTag, "min": a.minValue, "default": a.defaultValue, "max": a.maxValue}
+                    for a in font["fvar"].axes]
+        return {
+            "family": name.getBestFamilyName(),
+            "style": name.getBestSubFamilyName(),
+            "full_name": name.getBestFullName(),
+            "outline": outline,
+            "units_per_em": font["head"].unitsPerEm,
+            "glyph_count": font["maxp"].numGlyphs,
+            "weight": font["OS/2"].usWeightClass if "OS/2" in font else None,
+            "axes": axes,
+            "unicodes": _format_unicode_ranges(cmap),
+            "arabic_chars": sum(1 for lo, hi in _unicode_ranges(ARABIC_UNICODES)
+                                for cp in range(lo, hi + 1) if cp in cmap),
+            "latin_chars": sum(1 for lo, hi in _unicode_ranges(LATIN_UNICODES)
+                               for cp in range(lo, hi + 1) if cp in cmap),
+            "arabic_coverage": sum(cp in cmap for cp in _ARABIC_LETTERS) / len(_ARABIC_LETTERS),
+            "latin_coverage": sum(cp in cmap for cp in _LATIN_LETTERS) / len(_LATIN_LETTERS),
+        }
+    finally:
+        font.close()
+
+_FONT_INDEX_COLUMNS = ("family", "style", "full_name", "outline", "units_per_em", "glyph_count",
+                       "weight", "axes", "arabic_chars", "latin_chars", "arabic_coverage",
+                       "latin_coverage", "unicodes")
+
+def _open_sqlite(path, version, schema):
+    """اتصال SQLite (صفوف كقواميس)؛ يُعاد إنشاء الجداول بـ schema عند تغيّر version"""
+    import sqlite3
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    db = sqlite3.connect(path, timeout=10)
+    db.row_factory = sqlite3.Row
+    if db.execute("PRAGMA user_version").fetchone()[0] != version:
+        # خيوط أو عمليات تفتح قاعدة جديدة معاً: الأولى تنشئ الجداول والبقية تنتظر قفل الكتابة ثم تجدها
+        db.isolation_level = None
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if db.execute("PRAGMA user_version").fetchone()[0] != version:
+                for statement in schema.split(";"):
+                    if statement.strip():
+                        db.execute(statement)
+                db.execute(f"PRAGMA user_version = {version}")
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.isolation_level = ""
+    return db
+
+def _open_font_index():
+    # تغيّر شكل الفهرس: إعادة بنائه من الملفات
+    path = FONT_INDEX_PATH or os.path.join(cache_dir(), "font_index.sqlite")
+    return _open_sqlite(path, FONT_INDEX_VERSION, """
+        DROP TABLE IF EXISTS fonts;
+        CREATE TABLE fonts (
+            path TEXT PRIMARY KEY, dir TEXT NOT NULL, file TEXT NOT NULL,
+            mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL,
+            family TEXT, style TEXT, full_name TEXT, outline TEXT,
+            units_per_em INTEGER, glyph_count INTEGER, weight INTEGER, axes TEXT,
+            arabic_chars INTEGER, latin_chars INTEGER,
+            arabic_coverage REAL, latin_coverage REAL, unicodes TEXT, error TEXT);
+        CREATE INDEX fonts_dir ON fonts (dir);
+    """)
+
+def _font_row(row):
+    info = dict(row)
+    info["axes"] = json.loads(info["axes"]) if info["axes"] else []
+    return info
+
+def _store_font_info(db, path, stamp, info, error=None):
+    values = [json.dumps(info.get(c)) if c == "axes" else info.get(c) for c in _FONT_INDEX_COLUMNS]
+    db.execute(
+        f"INSERT OR REPLACE INTO fonts (path, dir, file, mtime_ns, size, {', '.join(_FONT_INDEX_COLUMNS)}, error) "
+        f"VALUES ({', '.join('?' * (len(_FONT_INDEX_COLUMNS) + 6))})",
+        [path, os.path.dirname(path), os.path.basename(path), stamp[0], stamp[1]] + values + [error])
+
+def scan_fonts(directory=None):
+    """تحديث الفهرس لمجلد الخطوط: قراءة الملفات الجديدة أو المعدلة فقط
+
+    Files are matched by path, mtime and size; unchanged files are not
+    opened and deleted files are dropped from the index. Fonts that fail to
+    parse are kept with their error so they are not retried until they
+    change. Returns counts: added, updated, removed, unchanged, failed.
+    """
+    directory = os.path.abspath(directory or FONT_DIR)
+    found = {}
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.lower().endswith(FONT_EXTENSIONS):
+                st = entry.stat()
+                found[entry.path] = (st.st_mtime_ns, st.st_size)
+    counts = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "failed": 0}
+    with _FONT_INDEX_LOCK:
+        db = _open_font_index()
+        try:
+            known = {r["path"]: (r["mtime_ns"], r["size"])
+                     for r in db.execute("SELECT path, mtime_ns, size FROM fonts WHERE dir = ?", (directory,))}
+            # القراءة قبل الكتابة حتى لا يُقفل الفهرس أثناء فتح الخطوط
+            changed = []
+            for path, stamp in sorted(found.items()):
+                if known.get(path) == stamp:
+                    counts["unchanged"] += 1
+                    continue
+                try:
+                    info, error = read_font_info(path), None
+                except Exception as ex:
+                    info, error = {}, str(ex)
+                    counts["failed"] += 1
+                    write_log_line(f"[WARN] Font index: cannot read {os.path.basename(path)}: {ex}")
+                counts["updated" if path in known else "added"] += 1
+                changed.append((path, stamp, info, error))
+            removed = [p for p in known if p not in found]
+            with db:
+                for path, stamp, info, error in changed:
+                    _store_font_info(db, path, stamp, info, error)
+                db.executemany("DELETE FROM fonts WHERE path = ?", [(p,) for p in removed])
+            counts["removed"] = len(removed)
+        finally:
+            db.close()
+    write_log_line(f"Font index: {directory}: " + ", ".join(f"{k} {v}" for k, v in counts.items()))
+    return counts
+
+def list_fonts(query=None, script=None, outline=None, variable=None, directory=None):
+    """الخطوط المفهرسة مع التصفية، دون فتح أي ملف خط (لواجهة اختيار الخطوط)
+
+    ``query`` matches the family, full name or file name (case-insensitive
+    substring), ``script`` is ``"arabic"`` or ``"latin"`` (at least
+    ``FONT_INDEX_MIN_COVERAGE`` of the basic letters), ``outline`` is
+    ``"glyf"``, ``"CFF"`` or ``"CFF2"`` and ``variable`` filters on the
+    presence of an ``fvar`` table. Call ``scan_fonts`` first to pick up new
+    files. Returns dicts sorted by family and style.
+    """
+    where, params = ["dir = ?", "error IS NULL"], [os.path.abspath(directory or FONT_DIR)]
+    if query:
+        where.append("(family LIKE ? OR full_name LIKE ? OR file LIKE ?)")
+        params += [f"%{query}%"] * 3
+    if script:
+        if script not in ("arabic", "latin"):
+            raise ValueError(f"Unknown script: {script}")
+        where.append(f"{script}_coverage >= ?")
+        params.append(FONT_INDEX_MIN_COVERAGE)
+    if outline:
+        where.append("outline = ?")
+        params.append(outline)
+    if variable is not None:
+        where.append("axes != '[]'" if variable else "axes = '[]'")
+    db = _open_font_index()
+    try:
+        rows = db.execute(f"SELECT * FROM fonts WHERE {' AND '.join(where)} "
+                          "ORDER BY family COLLATE NOCASE, weight, style", params).fetchall()
+    finally:
+        db.close()
+    return [_font_row(r) for r in rows]
+
+def font_info(path):
+    """بيانات خط واحد من الفهرس، أو من الملف إن تغيّر (ويُحدَّث الفهرس)"""
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    db = _open_font_index()
+    try:
+        row = db.execute("SELECT * FROM fonts WHERE path = ?", (path,)).fetchone()
+        if row is not None and (row["mtime_ns"], row["size"]) == stamp and row["error"] is None:
+            return _font_row(row)
+        info = read_font_info(path)
+        with _FONT_INDEX_LOCK, db:
+            _store_font_info(db, path, stamp, info)
+    finally:
+        db.close()
+    return dict(info, path=path, dir=os.path.dirname(path), file=os.path.basename(path),
+                mtime_ns=stamp[0], size=stamp[1], error=None)
+
+# ---------- Merge catalog ----------
+MERGE_CATALOG_VERSION = 1
+# بصمات الملفات المحسوبة في هذه العملية: (مسار، وقت تعديل، حجم) -> sha256
+_INPUT_HASHES = {}
+
+def input_sha256(path):
+    """sha256 لملف إدخال، يُحسب مرة واحدة لكل نسخة منه في العملية"""
+    st = os.stat(path)
+    stamp = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    digest = _INPUT_HASHES.get(stamp)
+    if digest is None:
+        digest = _INPUT_HASHES[stamp] = file_sha256(path)
+    return digest
+
+def merge_request_key(a_path, e_path, pipeline, preview_themes, preview_profiles, instance=None):
+    """مفتاح الطلب: بصمتا الخطين + كل خيار يغيّر الناتج (المسار، المعاينات، النطاقات، المحوّل...)
+
+    Returns ``(key, arabic_sha, english_sha)``.
+    """
+    a_sha, e_sha = input_sha256(a_path), input_sha256(e_path)
+    payload = json.dumps({
+        "inputs": [a_sha, e_sha],
+        "pipeline": pipeline,
+        "instance": instance,
+        "themes": preview_themes,
+        "profiles": preview_profiles,
+        "unicodes": [COVERAGE_MODE, COVERAGE_POLICY] if COVERAGE_MODE == "coverage"
+                    else [ARABIC_UNICODES, LATIN_UNICODES],
+        "converter": CFF_CONVERTER,
+        "cu2qu_max_err": CU2QU_MAX_ERR,
+        "merge_engine": MERGE_ENGINE,
+        "optimize": [OUTPUT_OPTIMIZE, OUTPUT_WOFF2, OUTPUT_DROP_TABLES, OUTPUT_NAME_IDS, OUTPUT_GLYPH_NAMES],
+        "text": [PREVIEW_TEXT_ENGINE, AR_PREVIEW, EN_PREVIEW],
+        "fonttools": fonttools.version,
+        "version": MERGE_CATALOG_VERSION,
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest(), a_sha, e_sha
+
+def _open_merge_catalog():
+    return _open_sqlite(MERGE_CATALOG_PATH, MERGE_CATALOG_VERSION, """
+        DROP TABLE IF EXISTS merges;
+        CREATE TABLE merges (
+            key TEXT PRIMARY KEY, arabic TEXT NOT NULL, english TEXT NOT NULL,
+            arabic_sha TEXT NOT NULL, english_sha TEXT NOT NULL, options TEXT,
+            font_path TEXT NOT NULL, preview_paths TEXT, font_size INTEGER,
+            preview_size INTEGER, seconds REAL, stages TEXT, created REAL NOT NULL);
+        CREATE INDEX merges_arabic ON merges (arabic);
+        CREATE INDEX merges_english ON merges (english);
+        CREATE INDEX merges_inputs ON merges (arabic_sha, english_sha);
+        CREATE INDEX merges_created ON merges (created);
+    """)
+
+def _merge_row(row):
+    entry = dict(row)
+    for field in ("options", "preview_paths", "stages"):
+        entry[field] = json.loads(entry[field]) if entry[field] else None
+    return entry
+
+def lookup_merge(key):
+    """الدمج المسجل بهذا المفتاح إن كانت كل ملفاته موجودة، وإلا None (ويُحذف السجل)"""
+    db = _open_merge_catalog()
+    try:
+        row = db.execute("SELECT * FROM merges WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        entry = _merge_row(row)
+        woff2 = (entry["options"] or {}).get("woff2")
+        if all(os.path.exists(p) for p in [entry["font_path"]] + (entry["preview_paths"] or [])
+               + ([woff2] if woff2 else [])):
+            return entry
+        # حذف المستخدم بعض الملفات: الطلب يُنفذ من جديد
+        with db:
+            db.execute("DELETE FROM merges WHERE key = ?", (key,))
+        return None
+    finally:
+        db.close()
+
+def record_merge(key, a_name, e_name, a_sha, e_sha, options, font_path, preview_paths,
+                 seconds=None, stages=None):
+    """تسجيل دمج مكتمل مع مسارات وأحجام نواتجه وأزمنة مراحله"""
+    db = _open_merge_catalog()
+    try:
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO merges VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, a_name, e_name, a_sha, e_sha, json.dumps(options, default=str), font_path,
+                 json.dumps(preview_paths), os.path.getsize(font_path),
+                 sum(os.path.getsize(p) for p in preview_paths), seconds,
+                 json.dumps(stages) if stages else None, time.time()))
+    finally:
+        db.close()
+
+def list_merges(query=None, arabic=None, english=None, limit=100):
+    """عمليات الدمج المسجلة، الأحدث أولاً
+
+    ``arabic``/``english`` match an input font name exactly (indexed);
+    ``query`` is a case-insensitive substring of either input name or the
+    output path.
+    """
+    where, params = [], []
+    if arabic:
+        where.append("arabic = ?")
+        params.append(arabic)
+    if english:
+        where.append("english = ?")
+        params.append(english)
+    if query:
+        where.append("(arabic LIKE ? OR english LIKE ? OR font_path LIKE ?)")
+        params += [f"%{query}%"] * 3
+    sql = "SELECT * FROM merges"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    db = _open_merge_catalog()
+    try:
+        rows = db.execute(sql + " ORDER BY created DESC LIMIT ?", params + [limit]).fetchall()
+    finally:
+        db.close()
+    return [_merge_row(r) for r in rows]
+
+def _catalog_output_base(base, key):
+    """اسم الناتج: الاسم المعتاد إن كان متاحاً، وإلا الاسم مع بداية المفتاح (بدون تجربة _1، _2...)"""
+    if not os.path.exists(os.path.join(FONT_DIR, "merged", base + ".ttf")):
+        return base
+    return f"{base}_{key[:8]}"
+
+# ---------- Intermediate cache ----------
+# عدّادات الكاش للدمج الجاري في هذا الخيط: RunMetrics.cache، أو قاموس المرحلة في عملية فرعية.
+# لا عدّادات عامة، فلا تتداخل إحصاءات مهام submit_merge المتزامنة
+_CACHE_CONTEXT = threading.local()
+_CACHE_STATS_LOCK = threading.Lock()
+
+def current_cache_stats():
+    return getattr(_CACHE_CONTEXT, "stats", None)
+
+def add_cache_stats(stats, extra):
+    if stats is None or not extra:
+        return
+    with _CACHE_STATS_LOCK:
+        for outcome, count in extra.items():
+            stats[outcome] += count
+
+def _count_cache(outcome):
+    add_cache_stats(current_cache_stats(), {outcome: 1})
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                h.update(mapped)
+        except (ValueError, OSError):
+            # ملف فارغ أو نظام ملفات لا يدعم mmap
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+def cache_key(src_path, stage, **params):
+    """مفتاح مبني على محتوى الملف ومرحلة المعالجة ومعاملاتها"""
+    payload = json.dumps({
+        "input": input_sha256(src_path),
+        "stage": stage,
+        "params": params,
+        "fonttools": fonttools.version,
+        "version": CACHE_VERSION,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _cache_path(key):
+    return os.path.join(cache_dir(), key + ".ttf")
+
+def cache_fetch(key, dst):
+    """نسخ النتيجة المخزنة إلى dst إن وجدت"""
+    if not CACHE_ENABLED or key is None:
+        return False
+    cached = _cache_path(key)
+    try:
+        shutil.copyfile(cached, dst)
+    except OSError:
+        _count_cache("misses")
         return False
+    try:
+        # تحديث وقت التعديل ليعكس آخر استخدام (LRU)
+        os.utime(cached, None)
+    except OSError:
+        pass
+    _count_cache("hits")
+    return True
+
+def cache_fetch_bytes(key):
+    """قراءة النتيجة المخزنة كبايتات (None إن لم توجد)"""
+    if not CACHE_ENABLED or key is None:
+        return None
+    cached = _cache_path(key)
+    try:
+        with open(cached, "rb") as f:
+            data = f.read()
+    except OSError:
+        _count_cache("misses")
+        return None
+    try:
+        os.utime(cached, None)
+    except OSError:
+        pass
+    _count_cache("hits")
+    return data
+
+def cache_store(key, src):
+    if not CACHE_ENABLED or key is None:
+        return
+    try:
+        tmp = _cache_path(key) + f".{os.getpid()}.tmp"
+        if isinstance(src, bytes):
+            with open(tmp, "wb") as f:
+                f.write(src)
+        else:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, _cache_path(key))
+    except OSError as ex:
+        write_log_line(f"[WARN] Cache store failed: {ex}")
+        return
+    _cache_evict()
+
+def _cache_evict():
+    """حذف أقدم الملفات حتى يصبح الحجم ضمن CACHE_MAX_BYTES"""
+    try:
+        entries = []
+        total = 0
+        with os.scandir(cache_dir()) as it:
+            for entry in it:
+                if not entry.name.endswith(".ttf"):
+                    continue
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        if total <= CACHE_MAX_BYTES:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= CACHE_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+    except OSError as ex:
+        write_log_line(f"[WARN] Cache eviction failed: {ex}")
+
+def _cache_key_or_none(src_path, stage, **params):
+    if not CACHE_ENABLED:
+        return None
+    try:
+        return cache_key(src_path, stage, **params)
+    except OSError:
+        return None
+
+def _sfnt_tag(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(4)
+    except OSError:
+        return b""
+
+# ---------- Persistent FontForge worker ----------
+# يعمل داخل fontforge -lang=py ويقرأ مهمة JSON في كل سطر من stdin.
+# الردود تبدأ بـ @@ لتمييزها عن أي مخرجات أخرى من FontForge.
+_FONTFORGE_WORKER_SCRIPT = r'''
+import sys, json, fontforge
+reply_out = sys.stdout
+sys.stdout = sys.stderr
+def reply(obj):
+    reply_out.write("@@" + json.dumps(obj) + "\n")
+    reply_out.flush()
+reply({"ready": True})
+for line in iter(sys.stdin.readline, ""):
+    job = {}
+    try:
+        job = json.loads(line)
+        op = job["op"]
+        if op == "convert":
+            font = fontforge.open(job["src"])
+            font.generate(job["dst"])
+            font.close()
+        elif op == "merge":
+            font = fontforge.open(job["paths"][0])
+            for extra in job["paths"][1:]:
+                font.mergeFonts(extra)
+            font.generate(job["out"])
+            font.close()
+        elif op != "ping":
+            raise ValueError("unknown op: %s" % op)
+        reply({"id": job.get("id"), "ok": True})
+    except Exception as ex:
+        reply({"id": job.get("id"), "ok": False, "error": str(ex)})
+'''
+
+class FontForgeWorker:
+    """عملية FontForge دائمة تُدار عبر أنابيب stdin/stdout
+
+    Jobs are sent one at a time as JSON lines. The worker is started on
+    first use, restarted (and the job retried once) if it crashes, and
+    killed when a job exceeds ``timeout`` seconds or the calling merge job
+    is cancelled.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout or FONTFORGE_TIMEOUT
+        self.proc = None
+        self._replies = None
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def _alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def _start(self):
+        self.stop()
+        self.proc = subprocess.Popen(
+            ["fontforge", "-quiet", "-lang=py", "-c", _FONTFORGE_WORKER_SCRIPT],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True, bufsize=1)
+        self._replies = queue.Queue()
+        reader = threading.Thread(target=self._read_replies, args=(self.proc, self._replies), daemon=True)
+        reader.start()
+        ready = self._replies.get(timeout=self.timeout)
+        if ready is None:
+            self.stop()
+            raise RuntimeError("FontForge worker exited during startup")
+        write_log_line(f"FontForge worker: Started (pid {self.proc.pid})")
+
+    @staticmethod
+    def _read_replies(proc, replies):
+        for line in proc.stdout:
+            if line.startswith("@@"):
+                replies.put(line[2:].strip())
+        replies.put(None)
+
+    def _wait_reply(self):
+        """انتظار الرد على دفعات قصيرة لفحص الإلغاء؛ queue.Empty عند انتهاء المهلة"""
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                return self._replies.get(timeout=max(0.0, min(0.25, deadline - time.time())))
+            except queue.Empty:
+                if cancel_requested():
+                    # العملية مشغولة بمهمة ملغاة: إنهاؤها، وستُعاد عند المهمة التالية
+                    self.stop()
+                    check_cancelled()
+                if time.time() >= deadline:
+                    raise
+
+    def stop(self):
+        proc, self.proc = self.proc, None
+        if proc is None:
+            return
+        try:
+            proc.kill()
+            proc.wait(timeout=5)
+        except Exception:
+            pass
+
+    def run(self, op, **args):
+        """تنفيذ مهمة وإرجاع الرد (dict) أو رفع RuntimeError"""
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if not self._alive():
+                        self._start()
+                    self._next_id += 1
+                    job_id = self._next_id
+                    self.proc.stdin.write(json.dumps(dict(args, op=op, id=job_id)) + "\n")
+                    self.proc.stdin.flush()
+                except (OSError, ValueError, queue.Empty) as ex:
+                    write_log_line(f"[WARN] FontForge worker unavailable: {ex}")
+                    self.stop()
+                    continue
+                try:
+                    raw = self._wait_reply()
+                except queue.Empty:
+                    # مهمة عالقة: إنهاء العملية، وستُعاد عند المهمة التالية
+                    self.stop()
+                    raise RuntimeError(f"FontForge worker timed out after {self.timeout}s ({op})")
+                if raw is None:
+                    write_log_line(f"[WARN] FontForge worker crashed during {op}, restarting")
+                    self.stop()
+                    continue
+                reply = json.loads(raw)
+                if not reply.get("ok"):
+                    raise RuntimeError(reply.get("error") or f"FontForge {op} failed")
+                return reply
+            raise RuntimeError(f"FontForge worker failed to run {op}")
+
+_FONTFORGE_WORKER = None
+
+def get_fontforge_worker():
+    """عامل FontForge المشترك في هذه العملية، أو None إن لم يكن متاحاً"""
+    global _FONTFORGE_WORKER
+    if not FONTFORGE_WORKER_ENABLED or not shutil_which("fontforge"):
+        return None
+    if _FONTFORGE_WORKER is None:
+        _FONTFORGE_WORKER = FontForgeWorker()
+        atexit.register(_FONTFORGE_WORKER.stop)
+    return _FONTFORGE_WORKER
+
+# ---------- Native CFF to TrueType conversion ----------
+# جداول التغيير لا تنطبق على glyf الناتج من CFF2 عند الموضع الافتراضي
+_CFF2_VARIATION_TABLES = ("fvar", "avar", "HVAR", "VVAR", "MVAR", "gvar", "cvar")
+
+def convert_cff_to_glyf(font, max_err=None):
+    """تحويل مخططات CFF/CFF2 إلى glyf تربيعية داخل العملية (cu2qu)
+
+    ``max_err`` is the curve approximation tolerance in units of a
+    1000-unitsPerEm font (default ``CU2QU_MAX_ERR``). The font is modified
+    in place and returned.
+    """
+    if "CFF " not in font and "CFF2" not in font:
+        return font
+    from fontTools.pens.cu2quPen import Cu2QuPen
+    from fontTools.pens.ttGlyphPen import TTGlyphPen
+    if max_err is None:
+        max_err = CU2QU_MAX_ERR
+    max_err = max_err * font['head'].unitsPerEm / 1000.0
+    glyph_order = font.getGlyphOrder()
+    glyph_set = font.getGlyphSet()
+
+    glyf = ttLib.newTable("glyf")
+    glyf.glyphOrder = glyph_order
+    glyf.glyphs = {}
+    for name in glyph_order:
+        pen = TTGlyphPen(None)
+        # CFF يدور عكس اتجاه TrueType
+        glyph_set[name].draw(Cu2QuPen(pen, max_err, reverse_direction=True))
+        glyf.glyphs[name] = pen.glyph()
+
+    is_cff2 = "CFF2" in font
+    for tag in ("CFF ", "CFF2", "VORG"):
+        if tag in font:
+            del font[tag]
+    if is_cff2:
+        for tag in _CFF2_VARIATION_TABLES:
+            if tag in font:
+                del font[tag]
+    font["glyf"] = glyf
+    font["loca"] = ttLib.newTable("loca")
+
+    maxp = font["maxp"]
+    maxp.tableVersion = 0x00010000
+    for attr in ("maxZones", "maxTwilightPoints", "maxStorage", "maxFunctionDefs",
+                 "maxInstructionDefs", "maxStackElements", "maxSizeOfInstructions",
+                 "maxComponentElements", "maxComponentDepth"):
+        setattr(maxp, attr, 0)
+    maxp.maxZones = 1
+    # باقي الحقول (maxPoints، maxContours...) تُحسب عند الحفظ
+
+    font["head"].glyphDataFormat = 0
+    post = font["post"]
+    if post.formatType == 3.0:
+        # الاحتفاظ بأسماء الحروف التي كانت في CFF
+        post.formatType = 2.0
+        post.extraNames = []
+        post.mapping = {}
+        post.glyphOrder = glyph_order
+    font.sfntVersion = "\x00\x01\x00\x00"
+    return font
+
+def _cff_converter():
+    """اسم المحوّل المستخدم (يدخل في مفتاح التخزين المؤقت)"""
+    if CFF_CONVERTER == "native":
+        return f"native:{CU2QU_MAX_ERR}"
+    return "fontforge" if shutil_which("fontforge") else "fonttools"
 
 # ---------- FontForge conversion ----------
 def fontforge_convert_to_ttf(src, dst):
+    worker = get_fontforge_worker()
+    if worker is not None:
+        try:
+            worker.run("convert", src=src, dst=dst)
+            if os.path.exists(dst):
+                write_log_line(f"FontForge worker: Converted {os.path.basename(src)} to TTF")
+                return True
+        except MergeCancelled:
+            raise
+        except Exception as ex:
+            write_log_line(f"[WARN] FontForge worker convert failed: {ex}")
     s = src.replace('\\', '\\\\').replace('"', r'\"')
     d = dst.replace('\\', '\\\\').replace('"', r'\"')
     script = f'Open("{s}"); SelectWorthOutputting(); Generate("{d}"); Close();'
     cmd = ["fontforge", "-quiet", "-lang=ff", "-c", script]
     try:
-        res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=120)
+        res = run_subprocess(cmd, timeout=120)
         if res.returncode == 0 and os.path.exists(dst):
             write_log_line(f"FontForge: Converted {os.path.basename(src)} to TTF")
             return True
         else:
             cmd2 = ["fontforge", "-quiet", "-lang=py", "-c", f'font=fontforge.open("{s}"); font.generate("{d}"); font.close()']
-            res2 = subprocess.run(cmd2, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=120)
+            res2 = run_subprocess(cmd2, timeout=120)
             if res2.returncode == 0 and os.path.exists(dst):
                 write_log_line(f"FontForge: Converted {os.path.basename(src)} to TTF (py)")
                 return True
             return False
+    except MergeCancelled:
+        raise
     except Exception as ex:
         write_log_line(f"FontForge exception: {ex}")
         return False
 
-def convert_otf_to_ttf(path, temp_files):
+def convert_otf_to_ttf(path, temp_files, out_dir=None):
     base, ext = os.path.splitext(path)
+    out = base + "_to_ttf.ttf"
+    if out_dir:
+        out = os.path.join(out_dir, os.path.basename(out))
+    converter = _cff_converter()
+    key = None
+    if ext.lower() == ".otf" or _sfnt_tag(path) == b"OTTO":
+        # وجود نتيجة مخزنة يغني عن فتح الخط أصلاً
+        key = _cache_key_or_none(path, "convert", converter=converter)
+        if cache_fetch(key, out):
+            temp_files.append(out)
+            write_log_line(f"Cache: Reused converted {os.path.basename(path)}")
+            return out
     try:
-        font = TTFont(path)
+        font = open_font_mapped(path)
     except Exception as ex:
         write_log_line(f"خطأ فتح الخط {path}: {ex}")
         raise RuntimeError(f"Cannot open font {path}: {ex}")
-    needs_conv = False
-    if ext.lower() == ".otf":
-        needs_conv = True
-    if "CFF " in font.keys() or "CFF2" in font.keys():
-        needs_conv = True
-    if not needs_conv:
-        return path
-    out = base + "_to_ttf.ttf"
-    if shutil_which("fontforge"):
-        ok = fontforge_convert_to_ttf(path, out)
-        if ok:
+    # الخط مفتوح فوق mmap: يُغلق في كل المسارات حتى لا تتراكم الخرائط والواصفات
+    try:
+        needs_conv = False
+        if ext.lower() == ".otf":
+            needs_conv = True
+        if "CFF " in font.keys() or "CFF2" in font.keys():
+            needs_conv = True
+        if not needs_conv:
+            return path
+        if converter.startswith("native"):
+            try:
+                convert_cff_to_glyf(font)
+                font.flavor = None
+                font.save(out)
+                temp_files.append(out)
+                write_log_line(f"fontTools: Converted {os.path.basename(path)} CFF outlines to TrueType")
+                cache_store(key, out)
+                return out
+            except Exception as ex:
+                write_log_line(f"[WARN] Native CFF conversion failed for {os.path.basename(path)}: {ex}")
+                # التحويل عدّل الخط جزئياً: إغلاقه وإعادة فتح الأصل
+                font.close()
+                font = open_font_mapped(path)
+        if shutil_which("fontforge"):
+            ok = fontforge_convert_to_ttf(path, out)
+            if ok:
+                temp_files.append(out)
+                cache_store(key, out)
+                return out
+            else:
+                write_log_line(f"FontForge failed to convert {os.path.basename(path)}")
+        try:
+            font.flavor = None
+            font.save(out)
             temp_files.append(out)
+            write_log_line(f"fontTools: Saved {os.path.basename(path)} as TTF")
+            if converter == "fonttools":
+                cache_store(key, out)
             return out
-        else:
-            write_log_line(f"FontForge failed to convert {os.path.basename(path)}")
-    try:
-        font.flavor = None
-        font.save(out)
-        temp_files.append(out)
-        write_log_line(f"fontTools: Saved {os.path.basename(path)} as TTF")
-        return out
-    except Exception as ex:
-        write_log_line(f"فشل تحويل عن طريق fontTools: {ex}")
-        raise RuntimeError(f"Failed to convert {path} to TTF: {ex}")
+        except Exception as ex:
+            write_log_line(f"فشل تحويل عن طريق fontTools: {ex}")
+            raise RuntimeError(f"Failed to convert {path} to TTF: {ex}")
+    finally:
+        font.close()
 
 # ---------- UnitsPerEm unification ----------
-def try_unify_units(paths):
-    fonts = []
-    for p in paths:
-        fonts.append(TTFont(p))
-    units = [f['head'].unitsPerEm for f in fonts]
-    target = max(units)
-    for idx, f in enumerate(fonts):
-        old = f['head'].unitsPerEm
-        if old == target:
-            continue
-        scale = float(target) / float(old)
-        write_log_line(f"fontTools: Unified unitsPerEm from {old} to {target}")
+def scale_font_units(f, target):
+    """تحجيم خط مفتوح (TTFont) إلى unitsPerEm = target في الذاكرة
+
+    Every table that carries font units (glyf, hmtx/vmtx, kern, GPOS, GDEF,
+    OS/2, post...) is scaled by fontTools' ``scale_upem``; only when that
+    fails are the basic metrics scaled on their own.
+    """
+    old = f['head'].unitsPerEm
+    if old == target:
+        return
+    scale = float(target) / float(old)
+    write_log_line(f"fontTools: Unified unitsPerEm from {old} to {target}")
+    try:
+        from fontTools.ttLib.scaleUpem import scale_upem
+        scale_upem(f, int(target))
+    except Exception as ex:
+        write_log_line(f"[WARN] Scaling outlines failed: {ex}. Trying metrics-only.")
         try:
-            if 'glyf' in f.keys():
-                glyf = f['glyf']
-                for gname in glyf.keys():
-                    glyph = glyf[gname]
-                    try:
-                        if glyph.isComposite():
-                            glyph.transform((scale, 0, 0, scale, 0, 0))
-                            continue
-                    except Exception:
-                        pass
-                    try:
-                        coords, endPts, flags = glyph.getCoordinates(glyf)
-                        for i in range(len(coords)):
-                            x, y = coords[i]
-                            coords[i] = (int(round(x * scale)), int(round(y * scale)))
-                        try:
-                            glyph.recalcBounds(glyf)
-                        except Exception:
-                            pass
-                    except Exception:
-                        pass
-            try:
-                hmtx = f['hmtx'].metrics
-                for gname, (adv, lsb) in list(hmtx.items()):
-                    hmtx[gname] = (int(round(adv * scale)), int(round(lsb * scale)))
-            except Exception:
-                pass
+            hmtx = f['hmtx'].metrics
+            for gname, (adv, lsb) in list(hmtx.items()):
+                hmtx[gname] = (int(round(adv * scale)), int(round(lsb * scale)))
             if 'OS/2' in f.keys():
-                try:
-                    os2 = f['OS/2']
-                    if hasattr(os2, 'usWinAscent'):
-                        os2.usWinAscent = int(round(os2.usWinAscent * scale))
-                        os2.usWinDescent = int(round(os2.usWinDescent * scale))
-                except Exception:
-                    pass
+                os2 = f['OS/2']
+                if hasattr(os2, 'usWinAscent'):
+                    os2.usWinAscent = int(round(os2.usWinAscent * scale))
+                    os2.usWinDescent = int(round(os2.usWinDescent * scale))
             if 'hhea' in f.keys():
-                try:
-                    f['hhea'].ascent = int(round(getattr(f['hhea'], 'ascent', 0) * scale))
-                    f['hhea'].descent = int(round(getattr(f['hhea'], 'descent', 0) * scale))
-                except Exception:
-                    pass
+                f['hhea'].ascent = int(round(getattr(f['hhea'], 'ascent', 0) * scale))
+                f['hhea'].descent = int(round(getattr(f['hhea'], 'descent', 0) * scale))
             f['head'].unitsPerEm = int(target)
-        except Exception as ex:
-            write_log_line(f"[WARN] Scaling outlines failed: {ex}. Trying metrics-only.")
-            try:
-                hmtx = f['hmtx'].metrics
-                for gname, (adv, lsb) in list(hmtx.items()):
-                    hmtx[gname] = (int(round(adv * scale)), int(round(lsb * scale)))
-                if 'OS/2' in f.keys():
-                    os2 = f['OS/2']
-                    if hasattr(os2, 'usWinAscent'):
-                        os2.usWinAscent = int(round(os2.usWinAscent * scale))
-                        os2.usWinDescent = int(round(os2.usWinDescent * scale))
-                if 'hhea' in f.keys():
-                    f['hhea'].ascent = int(round(getattr(f['hhea'], 'ascent', 0) * scale))
-                    f['hhea'].descent = int(round(getattr(f['hhea'], 'descent', 0) * scale))
-                f['head'].unitsPerEm = int(target)
-            except Exception as ex2:
-                write_log_line(f"[WARN] Metric-only scaling failed: {ex2}")
-        try:
-            f.save(paths[idx])
-        except Exception as ex:
-            write_log_line(f"[WARN] Saving scaled font failed: {ex}")
-    return paths
+        except Exception as ex2:
+            write_log_line(f"[WARN] Metric-only scaling failed: {ex2}")
+
+def scale_font_file(path, target, out_dir=None):
+    """تحجيم ملف خط إلى unitsPerEm = target (مع الكاش)
+
+    Without ``out_dir`` the file is rewritten in place; with it the scaled
+    copy goes to ``out_dir`` and the input is left untouched.
+    """
+    out = path
+    if out_dir:
+        out = os.path.join(out_dir, os.path.splitext(os.path.basename(path))[0] + "_upm.ttf")
+    font = open_font_mapped(path, lazy=True)
+    old = font['head'].unitsPerEm
+    font.close()
+    if old == target:
+        return path
+    key = _cache_key_or_none(path, "unify_units", target=int(target))
+    if key is not None and cache_fetch(key, out + ".cached"):
+        os.replace(out + ".cached", out)
+        write_log_line(f"Cache: Reused unitsPerEm {old} -> {target}")
+        return out
+    font = open_font_mapped(path)
+    scale_font_units(font, target)
+    try:
+        font.save(out)
+        cache_store(key, out)
+    except Exception as ex:
+        write_log_line(f"[WARN] Saving scaled font failed: {ex}")
+        return path
+    finally:
+        font.close()
+    return out
 
 # ---------- Subsetting ----------
-def subset_keep(path, unicodes, temp_files):
+def subset_keep(path, unicodes, temp_files, out_dir=None):
     base, _ = os.path.splitext(path)
     out = base + "_sub.ttf"
-    saved_argv = sys.argv[:]
+    if out_dir:
+        out = os.path.join(out_dir, os.path.basename(out))
+    key = _cache_key_or_none(path, "subset", unicodes=unicodes, hinting=False)
+    if cache_fetch(key, out):
+        temp_files.append(out)
+        write_log_line(f"Cache: Reused subset of {os.path.basename(path)}")
+        return out
+    # Subsetter مباشرة كما في مسار الذاكرة، لا pyftsubset عبر sys.argv المشترك بين الخيوط
     try:
-        sys.argv = ["pyftsubset", path, f"--unicodes={unicodes}", f"--output-file={out}", "--no-hinting"]
-        subset_main()
-    except SystemExit:
-        pass
+        font = open_font_mapped(path)
+        try:
+            subset_font(font, unicodes)
+            font.save(out)
+        finally:
+            font.close()
+    except MergeCancelled:
+        raise
     except Exception as ex:
         write_log_line(f"[WARN] Subset failed for {os.path.basename(path)}: {ex}")
-        sys.argv = saved_argv
         return path
+    temp_files.append(out)
+    write_log_line(f"fontTools.subset: Subset {os.path.basename(path)}")
+    cache_store(key, out)
+    return out
+
+def subset_font(font, unicodes):
+    """تقليص خط مفتوح في الذاكرة (مكافئ لـ pyftsubset --no-hinting)"""
+    from fontTools.subset import Subsetter, Options as SubsetOptions, parse_unicodes
+    subsetter = Subsetter(options=SubsetOptions(hinting=False))
+    subsetter.populate(unicodes=parse_unicodes(unicodes))
+    subsetter.subset(font)
+
+# ---------- Variable font instancing ----------
+def _instancer():
+    """instantiateVariableFont من varLib.instancer، أو من varLib.mutator في إصدارات fontTools القديمة"""
+    try:
+        from fontTools.varLib.instancer import instantiateVariableFont
+    except ImportError:
+        from fontTools.varLib.mutator import instantiateVariableFont
+    return instantiateVariableFont
+
+def resolve_instance_location(font, spec=None):
+    """موضع كامل (محور -> قيمة) لخط متغير
+
+    ``spec`` is None (every axis at its default), a dict or a
+    ``"wght=700,wdth=90"`` string of axis values, or the name of a named
+    instance (``"Bold"``). Axes the spec leaves out stay at their default,
+    values are clamped to the axis range and axes the font does not have
+    are ignored, so one spec can be applied to both inputs.
+    """
+    fvar = font["fvar"]
+    axes = {a.axisTag: a for a in fvar.axes}
+    location = {tag: a.defaultValue for tag, a in axes.items()}
+    if spec is None:
+        return location
+    if isinstance(spec, str) and "=" not in spec:
+        wanted = spec.strip().lower()
+        for instance in fvar.instances:
+            name = font["name"].getDebugName(instance.subfamilyNameID)
+            if name and name.strip().lower() == wanted:
+                location.update(instance.coordinates)
+                return location
+        raise RuntimeError(f"Named instance not found: {spec}")
+    if isinstance(spec, str):
+        spec = dict(part.split("=", 1) for part in spec.split(",") if part.strip())
+    for tag, value in spec.items():
+        axis = axes.get(tag.strip())
+        if axis is not None:
+            location[axis.axisTag] = min(max(float(value), axis.minValue), axis.maxValue)
+    return location
+
+def instantiate_font_file(path, spec, work_dir):
+    """تثبيت خط متغير على موضع واحد ليصبح خطاً ثابتاً (مع الكاش)
+
+    Static fonts are returned unchanged. The instance is written to
+    ``work_dir`` and cached by font hash plus the resolved location, so
+    every later stage sees a static font without ``gvar``/``HVAR``/``fvar``.
+    """
+    font = open_font_mapped(path, lazy=True)
+    try:
+        if "fvar" not in font:
+            return path
+        location = resolve_instance_location(font, spec)
     finally:
-        sys.argv = saved_argv
-    if os.path.exists(out):
-        temp_files.append(out)
-        write_log_line(f"pyftsubset: Subset font")
+        font.close()
+    desc = ",".join(f"{tag}={value:g}" for tag, value in sorted(location.items()))
+    base, ext = os.path.splitext(os.path.basename(path))
+    out = os.path.join(work_dir, base + "_" + desc.replace(",", "_").replace("=", "") + ext)
+    key = _cache_key_or_none(path, "instance", location=sorted(location.items()))
+    if cache_fetch(key, out):
+        write_log_line(f"Cache: Reused instance {os.path.basename(path)} at {desc}")
         return out
-    return path
+    font = open_font_mapped(path)
+    try:
+        _instancer()(font, location, inplace=True)
+        font.save(out)
+    finally:
+        font.close()
+    cache_store(key, out)
+    write_log_line(f"fontTools.instancer: Pinned {os.path.basename(path)} at {desc}")
+    return out
+
+# ---------- In-memory pipeline ----------
+def read_units_per_em(path):
+    font = open_font_mapped(path, lazy=True)
+    try:
+        return font['head'].unitsPerEm
+    finally:
+        font.close()
 
-def clean_languages(ar_path, en_path, temp_files):
-    arabic_ranges = ",".join([
-        "U+0600-06FF", "U+0750-077F", "U+08A0-08FF",
-        "U+FB50-FDFF", "U+FE70-FEFF", "U+0660-0669"
-    ])
-    ascii_range = "U+0020-007F"
-    ar_out = subset_keep(ar_path, arabic_ranges, temp_files)
-    en_out = subset_keep(en_path, ascii_range, temp_files)
-    return ar_out, en_out
+def open_font_for_pipeline(path, work_dir, temp_files):
+    """فتح الخط مرة واحدة، مع تحويل CFF عبر FontForge إن كان هو المحوّل المختار
+
+    FontForge only works on files, so it runs through ``convert_otf_to_ttf``
+    before parsing. The native converter runs later, on the subset font.
+    """
+    _, ext = os.path.splitext(path)
+    cff_like = ext.lower() == ".otf" or _sfnt_tag(path) == b"OTTO"
+    if cff_like and CFF_CONVERTER != "native" and shutil_which("fontforge"):
+        path = convert_otf_to_ttf(path, temp_files, out_dir=work_dir)
+    font = open_font_mapped(path)
+    font.flavor = None
+    return font
+
+def prepare_font_in_memory(path, unicodes, target, work_dir):
+    """تقليص وتحويل وتحجيم خط واحد دون حفظ وإعادة قراءة بين المراحل
+
+    The input is parsed once and the ``TTFont`` is passed through
+    subsetting, CFF conversion and unitsPerEm scaling, then serialized.
+    Returns the font as bytes; prepared fonts are cached as a whole, so a
+    repeated merge goes straight to the merge step.
+    """
+    key = _cache_key_or_none(path, "prepared", target=int(target), unicodes=unicodes,
+                             converter=_cff_converter(), hinting=False)
+    data = cache_fetch_bytes(key)
+    if data is not None:
+        write_log_line(f"Cache: Reused prepared {os.path.basename(path)}")
+        return data
+
+    font = open_font_for_pipeline(path, work_dir, [])
+    # التقليص قبل التحويل والتحجيم: لا يعتمد عليهما ويترك حروفاً أقل لهما
+    try:
+        subset_font(font, unicodes)
+        write_log_line(f"fontTools.subset: Subset {os.path.basename(path)} in memory")
+    except Exception as ex:
+        write_log_line(f"[WARN] Subset failed for {os.path.basename(path)}: {ex}")
+    if CFF_CONVERTER == "native" and ("CFF " in font or "CFF2" in font):
+        try:
+            convert_cff_to_glyf(font)
+            write_log_line(f"fontTools: Converted {os.path.basename(path)} CFF outlines to TrueType")
+        except Exception as ex:
+            write_log_line(f"[WARN] Native CFF conversion failed for {os.path.basename(path)}: {ex}")
+
+    scale_font_units(font, target)
+    buf = io.BytesIO()
+    font.save(buf)
+    data = buf.getvalue()
+    cache_store(key, data)
+    return data
+
+# الخطوط المحضرة في ذاكرة العملية: المفتاح -> bytes، بترتيب آخر استخدام
+_PREPARED_FONTS = {}
+_PREPARED_LOCK = threading.Lock()
+
+def _prepared_key(path, unicodes, target):
+    # بصمة المحتوى لا المسار: نسخ ثابتة من خط متغير تُكتب في مجلد معالجة جديد لكل دمج
+    return (input_sha256(path), int(target), unicodes, _cff_converter())
+
+def prepared_fetch(key):
+    with _PREPARED_LOCK:
+        data = _PREPARED_FONTS.pop(key, None)
+        if data is not None:
+            _PREPARED_FONTS[key] = data
+        return data
+
+def prepared_store(key, data):
+    """حفظ خط محضر في الذاكرة مع حذف الأقدم حتى لا تتجاوز PREPARED_MEMORY_MAX_BYTES"""
+    if len(data) > PREPARED_MEMORY_MAX_BYTES:
+        return
+    with _PREPARED_LOCK:
+        _PREPARED_FONTS.pop(key, None)
+        _PREPARED_FONTS[key] = data
+        total = sum(len(d) for d in _PREPARED_FONTS.values())
+        while total > PREPARED_MEMORY_MAX_BYTES:
+            total -= len(_PREPARED_FONTS.pop(next(iter(_PREPARED_FONTS))))
+
+def prepare_fonts_in_memory(paths, unicode_sets, work_dir, temp_files, advance=None):
+    """تحضير عدة خطوط بالتوازي (مرحلة لكل خط) عبر StageScheduler
+
+    Returns one serialized font (bytes) per input, ready for
+    ``merge_fonts``. ``advance`` is called with the input's index
+    as soon as that input is ready. Fonts prepared earlier in this process
+    for the same target unitsPerEm are taken from memory (see
+    ``PREPARED_MEMORY_MAX_BYTES``); the lookup happens here, in the calling
+    process, because the stages themselves may run in a process pool.
+    """
+    target = max(read_units_per_em(p) for p in paths)
+    names = [f"prepare_{i}" for i in range(len(paths))]
+    keys = [_prepared_key(p, u, target) if PREPARED_MEMORY_MAX_BYTES else None
+            for p, u in zip(paths, unicode_sets)]
+    results = {}
+    scheduler = StageScheduler(on_done=lambda name: advance and advance(names.index(name)))
+    for name, key, p, u in zip(names, keys, paths, unicode_sets):
+        data = prepared_fetch(key) if key is not None else None
+        if data is not None:
+            write_log_line(f"Memory: Reused prepared {os.path.basename(p)} ({target} upem)")
+            results[name] = data
+            if advance:
+                advance(names.index(name))
+            continue
+        scheduler.add(name, prepare_font_in_memory, (p, u, target, work_dir), kind=_fonttools_stage_kind())
+    if len(results) < len(names):
+        results.update(scheduler.run())
+    for name, key in zip(names, keys):
+        if key is not None:
+            prepared_store(key, results[name])
+    return [results[name] for name in names]
 
 # ---------- Unique output name ----------
 def unique_name(path):
@@ -283,6 +2007,17 @@ def unique_name(path):
 
 # ---------- Merge with FontForge ----------
 def merge_fonts_with_fontforge(paths, out):
+    worker = get_fontforge_worker()
+    if worker is not None:
+        try:
+            worker.run("merge", paths=list(paths), out=out)
+            if os.path.exists(out):
+                write_log_line("FontForge worker: Merged fonts successfully")
+                return out
+        except MergeCancelled:
+            raise
+        except Exception as ex:
+            write_log_line(f"[WARN] FontForge worker merge failed: {ex}")
     try:
         # إنشاء نص فونت فورج للدمج
         script_content = f'''
@@ -299,10 +2034,10 @@ Close()
 
         # تنفيذ النص باستخدام فونت فورج
         cmd = ["fontforge", "-script", script_file]
-        res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=120)
+        res = run_subprocess(cmd, timeout=120)
 
         if res.returncode == 0 and os.path.exists(out):
-            write_log_line(f"FontForge: Merged fonts successfully")
+            write_log_line("FontForge: Merged fonts successfully")
             try:
                 os.remove(script_file)
             except:
@@ -312,260 +2047,1257 @@ Close()
             write_log_line(f"FontForge merge failed: {res.stderr.strip()}")
             raise RuntimeError(f"FontForge merge failed: {res.stderr.strip()}")
 
+    except MergeCancelled:
+        raise
     except Exception as ex:
         write_log_line(f"[ERROR] FontForge merge failed: {ex}")
-        # Fallback إلى fontTools إذا فشل فونت فورج
-        try:
-            merger = Merger()
-            merged = merger.merge(paths)
-            merged.save(out)
-            write_log_line(f"fontTools.merge: Merged fonts (fallback)")
-            return out
-        except Exception as ex2:
-            write_log_line(f"[ERROR] fontTools.merge also failed: {ex2}")
-            raise RuntimeError(f"All merge methods failed: {ex}, {ex2}")
-
-# ---------- Text shaping with Harfbuzz ----------
-def shape_text_harfbuzz(text, font_path, font_size, direction='ltr'):
-    if hb is None:
-        return None
-
+        raise RuntimeError(f"FontForge merge failed: {ex}")
+
+# ---------- Merge engine (fontTools) ----------
+# حقول hhea التي يشترط fontTools.merge تساويها وقيمتها القياسية صفر
+_HHEA_RESERVED = ("reserved0", "reserved1", "reserved2", "reserved3", "metricDataFormat")
+_HINTING_TABLES = ("fpgm", "prep", "cvt ", "hdmx", "LTSH", "VDMX")
+# جداول لها mergeMap في fontTools.merge لكن جداولها الفرعية لا تُدمج (يفشل الدمج كله)
+_MERGE_UNSUPPORTED_TABLES = ("MATH", "BASE", "JSTF")
+_MAXP_V1_FIELDS = ("maxPoints", "maxContours", "maxCompositePoints", "maxCompositeContours",
+                   "maxZones", "maxTwilightPoints", "maxStorage", "maxFunctionDefs",
+                   "maxInstructionDefs", "maxStackElements", "maxSizeOfInstructions",
+                   "maxComponentElements", "maxComponentDepth")
+
+def _open_merge_source(src):
+    if isinstance(src, (bytes, bytearray)):
+        return ttLib.TTFont(io.BytesIO(src), lazy=True)
+    return open_font_mapped(src, lazy=True)
+
+def _has_merge_handler(tag):
+    # استيراد fontTools.merge يضيف merge/mergeMap إلى أصناف الجداول
+    importlib.import_module("fontTools.merge")
+    table_class = ttLib.getTableClass(tag)
+    return hasattr(table_class, "mergeMap") or "merge" in vars(table_class)
+
+def _is_cid_keyed(font):
+    return "CFF " in font and hasattr(font["CFF "].cff.topDictIndex[0], "ROS")
+
+def _remove_hinting(font):
+    for tag in _HINTING_TABLES:
+        if tag in font:
+            del font[tag]
+    if "glyf" in font:
+        glyf = font["glyf"]
+        for name in font.getGlyphOrder():
+            glyf[name].removeHinting()
+    maxp = font["maxp"]
+    if maxp.tableVersion >= 0x00010000:
+        for attr in ("maxStorage", "maxFunctionDefs", "maxInstructionDefs",
+                     "maxStackElements", "maxSizeOfInstructions", "maxTwilightPoints"):
+            setattr(maxp, attr, 0)
+
+def _drop_required_features(font):
+    """نقل الميزة المطلوبة (ReqFeatureIndex) إلى قائمة ميزات اللغة؛ fontTools.merge لا يدمجها"""
+    moved = False
+    for tag in ("GSUB", "GPOS"):
+        if tag not in font or not font[tag].table.ScriptList:
+            continue
+        for record in font[tag].table.ScriptList.ScriptRecord:
+            script = record.Script
+            for langsys in [script.DefaultLangSys] + [r.LangSys for r in script.LangSysRecord]:
+                if langsys is None or langsys.ReqFeatureIndex == 0xFFFF:
+                    continue
+                if langsys.ReqFeatureIndex not in langsys.FeatureIndex:
+                    langsys.FeatureIndex.insert(0, langsys.ReqFeatureIndex)
+                    langsys.FeatureCount = len(langsys.FeatureIndex)
+                langsys.ReqFeatureIndex = 0xFFFF
+                moved = True
+    return moved
+
+def normalize_for_merge(fonts):
+    """توحيد ما يرفضه fontTools.merge بين الخطوط (تُعدَّل في مكانها)
+
+    Returns one flag per font telling whether it was changed:
+
+    - CFF outlines next to glyf ones, and CID-keyed CFF, are converted to
+      TrueType (``convert_cff_to_glyf``);
+    - all fonts are scaled to the largest unitsPerEm;
+    - ``head`` magic number / glyph data format, the reserved ``hhea``
+      fields and the ``maxp`` version are set to their standard values;
+    - ``vhea``/``vmtx`` are dropped unless every font has them;
+    - required GSUB/GPOS features become ordinary features of their
+      language systems;
+    - differing TrueType hinting programs are removed from all fonts, since
+      the merged font keeps only the first font's ``fpgm``/``prep``/``cvt``;
+    - tables ``Merger`` has no handler for, and ``_MERGE_UNSUPPORTED_TABLES``
+      whose subtables it cannot merge, are dropped.
+
+    Glyph name collisions are left to ``Merger``, which renames later
+    duplicates with a ``.N`` suffix, and duplicate code points keep the
+    first font's glyph.
+    """
+    changed = [False] * len(fonts)
+    names = [f["name"].getDebugName(4) or f"font {i}" for i, f in enumerate(fonts)]
+
+    def note(i, what):
+        changed[i] = True
+        write_log_line(f"Merge: {what} ({names[i]})")
+
+    for i, f in enumerate(fonts):
+        dropped = [tag for tag in f.keys() if tag != "GlyphOrder" and
+                   (tag in _MERGE_UNSUPPORTED_TABLES or not _has_merge_handler(tag))]
+        for tag in dropped:
+            del f[tag]
+        if dropped:
+            note(i, f"dropped tables fontTools.merge cannot merge: {', '.join(dropped)}")
+
+    mixed = any("glyf" in f for f in fonts)
+    for i, f in enumerate(fonts):
+        if ("CFF " in f or "CFF2" in f) and (mixed or "CFF2" in f or _is_cid_keyed(f)):
+            convert_cff_to_glyf(f)
+            note(i, "converted CFF outlines to TrueType")
+
+    target = max(f["head"].unitsPerEm for f in fonts)
+    for i, f in enumerate(fonts):
+        if f["head"].unitsPerEm != target:
+            old = f["head"].unitsPerEm
+            scale_font_units(f, target)
+            note(i, f"scaled unitsPerEm {old} -> {target}")
+
+    for i, f in enumerate(fonts):
+        head, hhea = f["head"], f["hhea"]
+        if head.magicNumber != 0x5F0F3CF5 or head.glyphDataFormat != 0:
+            head.magicNumber, head.glyphDataFormat = 0x5F0F3CF5, 0
+            note(i, "reset head magic number/glyph data format")
+        if any(getattr(hhea, attr, 0) for attr in _HHEA_RESERVED):
+            for attr in _HHEA_RESERVED:
+                setattr(hhea, attr, 0)
+            note(i, "cleared reserved hhea fields")
+
+    if len({f["maxp"].tableVersion for f in fonts}) > 1:
+        for i, f in enumerate(fonts):
+            maxp = f["maxp"]
+            if maxp.tableVersion < 0x00010000:
+                maxp.tableVersion = 0x00010000
+                for attr in _MAXP_V1_FIELDS:
+                    setattr(maxp, attr, 0)
+                maxp.maxZones = 1
+                note(i, "upgraded maxp to version 1.0")
+
+    if 0 < sum("vhea" in f for f in fonts) < len(fonts):
+        for i, f in enumerate(fonts):
+            if "vhea" in f:
+                for tag in ("vhea", "vmtx", "VORG"):
+                    if tag in f:
+                        del f[tag]
+                note(i, "dropped vertical metrics missing from the other fonts")
+
+    for i, f in enumerate(fonts):
+        if _drop_required_features(f):
+            note(i, "moved required layout features to the feature lists")
+
+    programs = [tuple(f.getTableData(tag) if tag in f else b"" for tag in ("fpgm", "prep", "cvt "))
+                for f in fonts]
+    if len({p for p in programs if any(p)}) > 1:
+        for i, f in enumerate(fonts):
+            if any(programs[i]):
+                _remove_hinting(f)
+                note(i, "removed conflicting TrueType hinting")
+    return changed
+
+def merge_fonts_fonttools(sources, out):
+    """دمج الخطوط (مسارات أو bytes) داخل العملية عبر fontTools.merge
+
+    Sources are opened lazily, normalized (see ``normalize_for_merge``) and
+    handed to ``Merger`` from memory: only fonts that needed changes are
+    re-serialized, the others are read in place. GSUB, GPOS and GDEF are
+    merged by ``Merger``; tables it cannot merge are dropped.
+    """
+    from fontTools.merge import Merger
+    fonts = [_open_merge_source(src) for src in sources]
     try:
-        # Load font file
-        with open(font_path, 'rb') as font_file:
-            font_data = font_file.read()
+        changed = normalize_for_merge(fonts)
+        inputs = []
+        for src, font, was_changed in zip(sources, fonts, changed):
+            if was_changed:
+                buf = io.BytesIO()
+                font.save(buf)
+                inputs.append(io.BytesIO(buf.getvalue()))
+            elif isinstance(src, (bytes, bytearray)):
+                inputs.append(io.BytesIO(src))
+            else:
+                inputs.append(src)
+    finally:
+        for font in fonts:
+            font.close()
+    check_cancelled()
+    merged = Merger().merge(inputs)
+    merged.save(out)
+    write_log_line(f"fontTools.merge: Merged {len(sources)} fonts")
+    return out
+
+def _merge_source_paths(sources, work_dir):
+    """FontForge يعمل على ملفات فقط: كتابة المصادر المحفوظة في الذاكرة إلى مجلد العمل"""
+    paths = []
+    for i, src in enumerate(sources):
+        if isinstance(src, (bytes, bytearray)):
+            path = os.path.join(work_dir, f"_merge_input_{i}.ttf")
+            with open(path, "wb") as f:
+                f.write(src)
+            src = path
+        paths.append(src)
+    return paths
 
-        # Create face and font
-        face = hb.Face(font_data)
-        font = hb.Font(face)
-        font.scale = (font_size, font_size)
-        hb.ot_font_set_funcs(font)
+def merge_fonts(sources, out, work_dir):
+    """دمج الخطوط (مسارات أو bytes) بالمحرك MERGE_ENGINE
 
-        # Create buffer
-        buf = hb.Buffer()
-        buf.add_str(text)
-        buf.guess_segment_properties()
+    The fontTools engine runs in-process; FontForge is only tried when it is
+    the configured engine or ``MERGE_FONTFORGE_FALLBACK`` is set, and only
+    if the ``fontforge`` binary exists. With ``MERGE_ENGINE = "fontforge"``
+    a failed FontForge merge falls back to fontTools.
+    """
+    fontforge = shutil_which("fontforge")
+    if MERGE_ENGINE == "fontforge" and fontforge:
+        try:
+            return merge_fonts_with_fontforge(_merge_source_paths(sources, work_dir), out)
+        except MergeCancelled:
+            raise
+        except Exception as ex:
+            write_log_line(f"[WARN] FontForge merge failed: {ex}. Trying fontTools.")
+    try:
+        return merge_fonts_fonttools(sources, out)
+    except MergeCancelled:
+        raise
+    except Exception as ex:
+        if MERGE_ENGINE == "fontforge" or not MERGE_FONTFORGE_FALLBACK or not fontforge:
+            raise RuntimeError(f"fontTools merge failed: {ex}")
+        write_log_line(f"[WARN] fontTools merge failed: {ex}. Trying FontForge.")
+    return merge_fonts_with_fontforge(_merge_source_paths(sources, work_dir), out)
+
+# ---------- Output optimization ----------
+def _table_sizes(path):
+    font = open_font_mapped(path, lazy=True)
+    try:
+        return {tag: font.reader.tables[tag].length for tag in font.reader.keys()}
+    finally:
+        font.close()
+
+def optimize_font_file(path, woff2=False):
+    """تقليص حجم الخط الناتج في مكانه، مع نسخة WOFF2 عند الطلب
+
+    Subsets the font to its own cmap with GSUB closure, so alternates no
+    lookup can reach are removed, keeping every layout feature. Hinting,
+    ``OUTPUT_DROP_TABLES``, name records outside ``OUTPUT_NAME_IDS`` and
+    (unless ``OUTPUT_GLYPH_NAMES``) glyph names are dropped, and glyf is
+    recompiled with the compact coordinate encoding. Returns
+    ``(woff2_path, report)``; ``report["tables"]`` maps each table tag to
+    ``[before, after]`` bytes (0 after for dropped tables).
+    """
+    from fontTools.subset import Subsetter, Options as SubsetOptions
+    before = _table_sizes(path)
+    tmp = path + ".opt"
+    font = open_font_mapped(path)
+    try:
+        options = SubsetOptions(hinting=False, notdef_outline=True, recalc_bounds=True,
+                                glyph_names=OUTPUT_GLYPH_NAMES, name_IDs=list(OUTPUT_NAME_IDS))
+        options.layout_features = ["*"]
+        # kern القديم يبقى فقط إن لم يكن في الخط GPOS يغني عنه
+        options.legacy_kern = "GPOS" not in font
+        options.drop_tables = sorted(set(options.drop_tables) | set(OUTPUT_DROP_TABLES))
+        glyphs_before = len(font.getGlyphOrder())
+        subsetter = Subsetter(options=options)
+        subsetter.populate(unicodes=(font.getBestCmap() or {}).keys())
+        subsetter.subset(font)
+        glyphs_after = len(font.getGlyphOrder())
+        font.save(tmp)
+    finally:
+        font.close()
+    # الحفظ إلى ملف جانبي: الأصل ما زال معروضاً عبر mmap أثناء الحفظ
+    os.replace(tmp, path)
+    after = _table_sizes(path)
+
+    report = {
+        "tables": {tag: [before.get(tag, 0), after.get(tag, 0)] for tag in sorted(set(before) | set(after))},
+        "total": [sum(before.values()), sum(after.values())],
+        "glyphs": [glyphs_before, glyphs_after],
+    }
+    for tag, (old, new) in report["tables"].items():
+        if old != new:
+            change = "dropped" if not new else f"{(new - old) / max(old, 1):+.1%}"
+            write_log_line(f"Optimize: {tag} {old} -> {new} bytes ({change})")
+    old, new = report["total"]
+    write_log_line(f"Optimize: {os.path.basename(path)} {old} -> {new} bytes "
+                   f"({(new - old) / max(old, 1):+.1%}), {glyphs_before} -> {glyphs_after} glyphs")
+
+    woff2_path = None
+    if woff2:
+        if _optional_import("brotli", "brotlicffi") is None:
+            write_log_line("[WARN] WOFF2 output needs the brotli module; skipped")
+        else:
+            from fontTools.ttLib import woff2 as woff2_module
+            woff2_path = os.path.splitext(path)[0] + ".woff2"
+            woff2_module.compress(path, woff2_path)
+            report["woff2"] = os.path.getsize(woff2_path)
+            write_log_line(f"Optimize: WOFF2 {report['woff2']} bytes")
+    return woff2_path, report
 
-        # Set direction
-        if direction == 'rtl':
-            buf.direction = 'rtl'
-            buf.script = 'arab'
-            buf.language = 'ar'
+# ---------- Text shaping with Harfbuzz ----------
+# وجوه HarfBuzz المفتوحة: (مسار، وقت تعديل، حجم الملف) -> hb.Face
+_HB_FACES = {}
+# خطوط HarfBuzzFont الجاهزة: (مفتاح الوجه، حجم الخط) -> HarfBuzzFont
+_HB_FONTS = {}
+_HB_FONTS_MAX = 32
+# الكاشان يُقرآن ويُكتبان من خيوط مهام submit_merge والدفعات
+_HB_LOCK = threading.Lock()
+
+def _font_file_stamp(path):
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+def get_hb_face(path):
+    """وجه HarfBuzz يُقرأ مرة واحدة لكل نسخة من الملف (المسار + وقت التعديل)"""
+    key = _font_file_stamp(path)
+    with _HB_LOCK:
+        face = _HB_FACES.get(key)
+        if face is None:
+            # نسخة قديمة من نفس الملف لم تعد صالحة
+            for old in [k for k in _HB_FACES if k[0] == key[0]]:
+                del _HB_FACES[old]
+            with open(path, "rb") as fh:
+                face = _harfbuzz().Face(fh.read())
+            _HB_FACES[key] = face
+        return face
+
+def get_harfbuzz_font(path, size):
+    """HarfBuzzFont مخزّن مؤقتاً لكل (ملف، حجم) مع كاش التشكيل والحروف المرسومة"""
+    key = (_font_file_stamp(path), size)
+    with _HB_LOCK:
+        font = _HB_FONTS.get(key)
+    if font is None:
+        font = HarfBuzzFont(get_hb_face(path), size)
+        with _HB_LOCK:
+            if len(_HB_FONTS) >= _HB_FONTS_MAX:
+                _HB_FONTS.clear()
+            font = _HB_FONTS.setdefault(key, font)
+    return font
+
+class _OutlineMixin:
+    """تحويل مخطط الحرف إلى مضلعات (المنحنيات تُقسَّم لخطوط) بإحداثيات الصورة
+
+    Combined with fontTools' ``BasePen`` by ``_outline_pen`` on first use.
+    """
 
-        # Shape text
-        hb.shape(font, buf)
+    def __init__(self, scale):
+        super().__init__(None)
+        self.scale = scale
+        self.contours = []
+        self._contour = None
+
+    def _xy(self, pt):
+        return (pt[0] * self.scale, -pt[1] * self.scale)
+
+    def _segments(self, *pts):
+        # عدد القطع حسب طول مضلع التحكم بالبكسل
+        length = sum(math.dist(a, b) for a, b in zip(pts, pts[1:])) * self.scale
+        return max(2, min(32, int(length / 8)))
+
+    def _moveTo(self, pt):
+        self._contour = [self._xy(pt)]
+        self.contours.append(self._contour)
+
+    def _lineTo(self, pt):
+        self._contour.append(self._xy(pt))
+
+    def _curveToOne(self, p1, p2, p3):
+        p0 = self._getCurrentPoint()
+        n = self._segments(p0, p1, p2, p3)
+        for i in range(1, n + 1):
+            t = i / n
+            u = 1 - t
+            a, b, c, d = u * u * u, 3 * u * u * t, 3 * u * t * t, t * t * t
+            self._contour.append(self._xy((a * p0[0] + b * p1[0] + c * p2[0] + d * p3[0],
+                                           a * p0[1] + b * p1[1] + c * p2[1] + d * p3[1])))
+
+    def _qCurveToOne(self, p1, p2):
+        p0 = self._getCurrentPoint()
+        n = self._segments(p0, p1, p2)
+        for i in range(1, n + 1):
+            t = i / n
+            u = 1 - t
+            a, b, c = u * u, 2 * u * t, t * t
+            self._contour.append(self._xy((a * p0[0] + b * p1[0] + c * p2[0],
+                                           a * p0[1] + b * p1[1] + c * p2[1])))
+
+    def _closePath(self):
+        self._contour = None
+
+    _endPath = _closePath
+
+_OUTLINE_PEN = None
+
+def _outline_pen(scale):
+    global _OUTLINE_PEN
+    if _OUTLINE_PEN is None:
+        from fontTools.pens.basePen import BasePen
+        _OUTLINE_PEN = type("_OutlinePen", (_OutlineMixin, BasePen), {})
+    return _OUTLINE_PEN(scale)
+
+def _bidi_runs(text):
+    """تقسيم سطر RTL إلى مقاطع اتجاهية بالترتيب المرئي (تبسيط لخوارزمية bidi)
+
+    Latin letters and digits form LTR runs (neutrals between two LTR
+    characters join them), everything else stays RTL; the run order is
+    then reversed for display. Enough for preview lines mixing Arabic,
+    numbers and the odd Latin word.
+    """
+    kinds = []
+    for ch in text:
+        cls = unicodedata.bidirectional(ch)
+        if cls in ("L", "EN", "AN"):
+            kinds.append("ltr")
+        elif cls in ("R", "AL"):
+            kinds.append("rtl")
+        elif cls == "NSM":
+            kinds.append(kinds[-1] if kinds else None)
+        else:
+            kinds.append(None)
+    # المحايدات: LTR فقط بين حرفين LTR وإلا اتجاه الفقرة
+    resolved = []
+    for i, kind in enumerate(kinds):
+        if kind is None:
+            before = next((k for k in reversed(kinds[:i]) if k), "rtl")
+            after = next((k for k in kinds[i + 1:] if k), "rtl")
+            kind = "ltr" if before == after == "ltr" else "rtl"
+        resolved.append(kind)
+    runs = []
+    for ch, kind in zip(text, resolved):
+        if runs and runs[-1][1] == kind:
+            runs[-1][0].append(ch)
+        else:
+            runs.append(([ch], kind))
+    return [("".join(chars), kind) for chars, kind in reversed(runs)]
 
-        # Get glyph information
-        infos = buf.glyph_infos
-        positions = buf.glyph_positions
+def _signed_area(points):
+    return sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1])) / 2
 
-        # Calculate text width and height
-        width = sum(pos.x_advance for pos in positions) / 64
-        height = font_size
+class HarfBuzzFont:
+    """خط معاينة يُشكّل النص بـ HarfBuzz ويرسم الحروف من مخططاتها
 
-        return width, height, infos, positions, font
+    Mirrors the parts of Pillow's ``FreeTypeFont`` the preview layout uses
+    (``getlength`` and ``getbbox`` with the ``la`` anchor) and adds
+    ``draw_text``. Every distinct string is shaped once and every glyph is
+    rasterized once per size, so measuring words, fitting lines and drawing
+    them all reuse the same runs. Glyphs are filled with the nonzero rule at
+    ``HB_SUPERSAMPLE``x and box-filtered down for anti-aliasing.
+    """
 
-    except Exception as e:
-        write_log_line(f"[WARN] HarfBuzz shaping failed: {e}")
-        return None
+    def __init__(self, face, size):
+        self.size = size
+        self.hb_font = _harfbuzz().Font(face)
+        # 26.6: كل بكسل = 64 وحدة
+        self.hb_font.scale = (size * 64, size * 64)
+        extents = self.hb_font.get_font_extents("ltr")
+        self.ascent = round(extents.ascender / 64)
+        self._runs = {}
+        self._glyphs = {}
+        self._extents = {}
+
+    def _shape_buffer(self, text, direction=None, language=None):
+        hb = _harfbuzz()
+        buf = hb.Buffer()
+        buf.add_str(text)
+        buf.guess_segment_properties()
+        if direction:
+            buf.direction = direction
+        if language:
+            buf.language = language
+        hb.shape(self.hb_font, buf)
+        return buf
+
+    def shape(self, text, direction=None, language=None):
+        """(قائمة (رقم الحرف، x، y) بالبكسل بالترتيب المرئي، العرض الكلي)"""
+        key = (text, direction, language)
+        run = self._runs.get(key)
+        if run is None:
+            if direction == "rtl":
+                segments = _bidi_runs(text)
+            else:
+                segments = [(text, direction)]
+            glyphs = []
+            pen_x = 0
+            for segment, seg_dir in segments:
+                buf = self._shape_buffer(segment, seg_dir, language if seg_dir == direction else None)
+                for info, pos in zip(buf.glyph_infos, buf.glyph_positions):
+                    glyphs.append((info.codepoint, (pen_x + pos.x_offset) / 64, pos.y_offset / 64))
+                    pen_x += pos.x_advance
+            run = self._runs[key] = (glyphs, pen_x / 64)
+        return run
+
+    def _glyph(self, gid):
+        """(قناع L، يسار، أعلى) للحرف بالنسبة لنقطة الأصل على خط القاعدة"""
+        if gid not in self._glyphs:
+            self._glyphs[gid] = self._rasterize(gid)
+        return self._glyphs[gid]
+
+    def _rasterize(self, gid):
+        ss = HB_SUPERSAMPLE
+        pen = _outline_pen(ss / 64)
+        self.hb_font.draw_glyph_with_pen(gid, pen)
+        contours = [c for c in pen.contours if len(c) >= 3]
+        if not contours:
+            return None
+        xs = [x for c in contours for x, _ in c]
+        ys = [y for c in contours for _, y in c]
+        left, top = math.floor(min(xs) / ss), math.floor(min(ys) / ss)
+        right, bottom = math.ceil(max(xs) / ss), math.ceil(max(ys) / ss)
+        size = ((right - left) * ss, (bottom - top) * ss)
+        # قاعدة nonzero: الكفاف باتجاه الكفاف الأكبر يُضاف والمعاكس يُطرح (الإضافة أولاً)
+        areas = [_signed_area(c) for c in contours]
+        outer = max(areas, key=abs) > 0
+        coverage = Image.new("L", size, 0)
+        for add in (True, False):
+            for contour, area in zip(contours, areas):
+                if (area > 0) == (outer == add):
+                    layer = Image.new("L", size, 0)
+                    ImageDraw.Draw(layer).polygon(
+                        [(x - left * ss, y - top * ss) for x, y in contour], fill=1)
+                    coverage = (ImageChops.add if add else ImageChops.subtract)(coverage, layer)
+        mask = coverage.point([0] + [255] * 255).reduce(ss)
+        return mask, left, top
+
+    def _glyph_box(self, gid):
+        """صندوق الحرف بالبكسل (يسار، أعلى، يمين، أسفل) من مقاييس HarfBuzz دون رسمه"""
+        if gid not in self._extents:
+            ext = self.hb_font.get_glyph_extents(gid)
+            if ext is None or ext.width == 0 or ext.height == 0:
+                box = None
+            else:
+                box = (math.floor(ext.x_bearing / 64), math.floor(-ext.y_bearing / 64),
+                       math.ceil((ext.x_bearing + ext.width) / 64),
+                       math.ceil(-(ext.y_bearing + ext.height) / 64))
+            self._extents[gid] = box
+        return self._extents[gid]
+
+    def getlength(self, text, direction=None, language=None, **kwargs):
+        return self.shape(text, direction, language)[1]
+
+    def getbbox(self, text, direction=None, language=None, **kwargs):
+        """الصندوق المحيط بالحبر بالنسبة لنقطة الرسم (أعلى يسار، مثل anchor="la")"""
+        glyphs, _ = self.shape(text, direction, language)
+        box = None
+        for gid, gx, gy in glyphs:
+            gbox = self._glyph_box(gid)
+            if gbox is None:
+                continue
+            x0 = round(gx) + gbox[0]
+            y0 = self.ascent - round(gy) + gbox[1]
+            x1 = round(gx) + gbox[2]
+            y1 = self.ascent - round(gy) + gbox[3]
+            box = (x0, y0, x1, y1) if box is None else (
+                min(box[0], x0), min(box[1], y0), max(box[2], x1), max(box[3], y1))
+        return box or (0, 0, 0, 0)
+
+    def draw_text(self, mask, xy, text, direction=None, language=None, **kwargs):
+        """رسم النص المشكَّل في قناع L (بنفس مزج draw.text بلون 255)"""
+        glyphs, _ = self.shape(text, direction, language)
+        x, y = xy
+        for gid, gx, gy in glyphs:
+            glyph = self._glyph(gid)
+            if glyph is None:
+                continue
+            gmask, left, top = glyph
+            px = round(x + gx) + left
+            py = round(y) + self.ascent - round(gy) + top
+            mask.paste(255, (px, py, px + gmask.size[0], py + gmask.size[1]), gmask)
 
 # ---------- Text wrapping helper ----------
-def wrap_text_to_lines(text, font, max_width, is_ar=False, draw=None):
+def measure_words(text, font, is_ar=False):
+    """قياس عرض كل كلمة مختلفة مرة واحدة، مع عرض المسافة تحت المفتاح " " """
+    kwargs = {"direction": "rtl", "language": "ar"} if is_ar else {}
+    widths = {" ": font.getlength(" ", **kwargs)}
+    for w in text.split(" "):
+        if w not in widths:
+            widths[w] = font.getlength(w, **kwargs)
+    return widths
+
+def wrap_text_to_lines(text, font, max_width, is_ar=False, draw=None, widths=None, scale=1.0):
     """
     Wrap text into lines that fit max_width.
     For Arabic, use original text and measure with direction='rtl'.
+
+    Every word is measured once (or taken from ``widths``, measured at
+    another size and multiplied by ``scale``) and line widths are summed
+    from the cached word widths instead of re-measuring each trial line.
     """
-    if draw is None:
-        draw = ImageDraw.Draw(Image.new("RGB", (10,10)))
-    words = text.split(" ")
+    if widths is None:
+        widths = measure_words(text, font, is_ar)
+        scale = 1.0
+    kwargs = {"direction": "rtl", "language": "ar"} if is_ar else {}
+    space_w = widths[" "] * scale
+    char_widths = {}
+
+    def char_width(ch):
+        if ch not in char_widths:
+            char_widths[ch] = font.getlength(ch, **kwargs)
+        return char_widths[ch]
+
     lines = []
     cur = ""
-    for w in words:
-        trial = (cur + " " + w).strip() if cur else w
-        if is_ar:
-            bbox = draw.textbbox((0,0), trial, font=font, direction="rtl", language="ar")
-        else:
-            bbox = draw.textbbox((0,0), trial, font=font)
-        w_px = bbox[2] - bbox[0]
-        if w_px <= max_width:
-            cur = trial
-        else:
-            if cur:
-                lines.append(cur)
+    cur_w = 0.0
+    for w in text.split(" "):
+        word_w = widths[w] * scale if w in widths else font.getlength(w, **kwargs)
+        trial_w = cur_w + space_w + word_w if cur else word_w
+        if trial_w <= max_width:
+            cur = (cur + " " + w).strip() if cur else w
+            cur_w = trial_w
+            continue
+        if cur:
+            lines.append(cur)
+        if word_w > max_width:
             # if single word too long, break by characters
-            if is_ar:
-                single_bbox = draw.textbbox((0,0), w, font=font, direction="rtl", language="ar")
-            else:
-                single_bbox = draw.textbbox((0,0), w, font=font)
-            if single_bbox[2] - single_bbox[0] > max_width:
-                # break into characters
-                part = ""
-                for ch in w:
-                    trial2 = part + ch
-                    if is_ar:
-                        bbox2 = draw.textbbox((0,0), trial2, font=font, direction="rtl", language="ar")
-                    else:
-                        bbox2 = draw.textbbox((0,0), trial2, font=font)
-                    if bbox2[2] - bbox2[0] <= max_width:
-                        part = trial2
-                    else:
-                        if part:
-                            lines.append(part)
-                        part = ch
-                if part:
-                    cur = part
+            part = ""
+            part_w = 0.0
+            for ch in w:
+                ch_w = char_width(ch)
+                if part_w + ch_w <= max_width:
+                    part += ch
+                    part_w += ch_w
                 else:
-                    cur = ""
-            else:
-                cur = w
+                    if part:
+                        lines.append(part)
+                    part, part_w = ch, ch_w
+            cur, cur_w = part, part_w
+        else:
+            cur, cur_w = w, word_w
     if cur:
         lines.append(cur)
     return lines
 
+def _fit_lines(lines, font, max_width, kwargs):
+    """قياس كل سطر مرة واحدة ونقل الكلمة الأخيرة للسطر التالي إن تجاوز العرض
+
+    Cached widths ignore kerning across word boundaries, so a line can
+    come out a few pixels too wide. Returns ``(line, bbox)`` pairs.
+    """
+    pending = list(lines)
+    fitted = []
+    while pending:
+        ln = pending.pop(0)
+        bbox = font.getbbox(ln, **kwargs)
+        words = ln.split(" ")
+        if bbox[2] - bbox[0] > max_width and len(words) > 1:
+            tail = words[-1]
+            if pending:
+                pending[0] = tail + " " + pending[0]
+            else:
+                pending.append(tail)
+            pending.insert(0, " ".join(words[:-1]))
+            continue
+        fitted.append((ln, bbox))
+    return fitted
+
+# ---------- Preview layout ----------
+def preview_text_engine():
+    """اختيار محرك تشكيل النص: raqm أو harfbuzz أو basic (arabic_reshaper + bidi)"""
+    has_raqm = features.check_feature("raqm")
+    available = {"raqm": has_raqm, "harfbuzz": _harfbuzz() is not None, "basic": True}
+    if available.get(PREVIEW_TEXT_ENGINE):
+        return PREVIEW_TEXT_ENGINE
+    if PREVIEW_TEXT_ENGINE != "auto":
+        write_log_line(f"[WARN] Preview text engine {PREVIEW_TEXT_ENGINE} not available, using auto")
+    if has_raqm:
+        return "raqm"
+    return "harfbuzz" if _harfbuzz() is not None else "basic"
+
+def _preview_font(merged_ttf, size, engine=None):
+    if engine == "harfbuzz":
+        try:
+            return get_harfbuzz_font(merged_ttf, size)
+        except Exception as ex:
+            write_log_line(f"[WARN] HarfBuzz font load failed, using Pillow: {ex}")
+    try:
+        return ImageFont.truetype(merged_ttf, size)
+    except Exception:
+        # استخدام الخط الافتراضي إذا فشل التحميل
+        return ImageFont.load_default()
+
+def _draw_preview_text(mask, draw, x, y, text, font, kwargs):
+    """رسم سطر في قناع L: الحروف المشكَّلة لـ HarfBuzzFont وإلا draw.text"""
+    if isinstance(font, HarfBuzzFont):
+        font.draw_text(mask, (x, y), text, **kwargs)
+    else:
+        draw.text((x, y), text, font=font, fill=255, **kwargs)
+
+def _fit_preview_size(merged_ttf, ref_font, ref_size, text, target_w, step=75, max_size=1500, engine=None):
+    """أصغر حجم من السلسلة ref_size + step*k يبلغ فيه عرض النص target_w
+
+    Same result as growing the size by ``step`` until the text is wide
+    enough (or ``max_size`` is reached), but the width is roughly linear
+    in the size, so the step is estimated from the reference width and
+    only corrected with one or two real measurements.
+    """
+    measured = {}
+
+    def width_at(size):
+        if size not in measured:
+            font = ref_font if size == ref_size else _preview_font(merged_ttf, size, engine)
+            bbox = font.getbbox(text)
+            measured[size] = bbox[2] - bbox[0]
+        return measured[size]
+
+    k_max = max(0, math.ceil((max_size - ref_size) / step))
+    w_ref = width_at(ref_size)
+    if w_ref >= target_w or k_max == 0:
+        return ref_size
+    if w_ref > 0:
+        k = math.ceil((ref_size * target_w / w_ref - ref_size) / step)
+    else:
+        k = k_max
+    k = min(max(k, 1), k_max)
+    while k < k_max and width_at(ref_size + step * k) < target_w:
+        k += 1
+    while k > 1 and width_at(ref_size + step * (k - 1)) >= target_w:
+        k -= 1
+    return ref_size + step * k
+
+def layout_preview(merged_ttf, W, H):
+    """حساب حجم الخط وتقسيم الأسطر ومواضعها لصورة المعاينة
+
+    Returns a list of ``(x, y, text, font, kwargs)`` entries ready for
+    ``_draw_preview_text``. Only a handful of rasterizer calls are made: the
+    reference measurements, one or two size checks and one bbox per line.
+    Without Raqm the HarfBuzz engine shapes the Arabic text in logical
+    order; ``arabic_reshaper`` is only the last resort.
+    """
+    engine = preview_text_engine()
+    write_log_line(f"Pillow has Raqm support: {features.check_feature('raqm')}, text engine: {engine}")
+
+    # ثوابت البكسل أدناه مضبوطة على عرض 6400 وتُحجَّم للأحجام الأخرى
+    scale_px = W / PREVIEW_LAYOUT_WIDTH
+
+    def px(value):
+        return max(1, int(round(value * scale_px)))
+
+    # حجم الخط الأساسي (تم تكبيره بنسبة 10%) وهو أيضاً حجم القياس المرجعي
+    base_size = px(330)
+    ref_font = _preview_font(merged_ttf, base_size, engine)
+    if engine == "harfbuzz" and not isinstance(ref_font, HarfBuzzFont):
+        engine = "basic"
+
+    # حساب عرض منطقة الالتفاف (~90% من العرض لملء الصورة)
+    max_w = int(W * 0.9)
+
+    # أصغر حجم يصل فيه النص الإنجليزي إلى 85% من العرض، ثم تصغيره بنسبة 10%
+    size = _fit_preview_size(merged_ttf, ref_font, base_size, EN_PREVIEW, W * 0.85,
+                             step=px(75), max_size=px(1500), engine=engine)
+    size = int(size * 0.9)
+    font = _preview_font(merged_ttf, size, engine)
+
+    # عرض الكلمات يُقاس مرة واحدة بالحجم المرجعي ويُحجَّم حسابياً
+    scalable_types = (ImageFont.FreeTypeFont, HarfBuzzFont)
+    scalable = isinstance(font, scalable_types) and isinstance(ref_font, scalable_types)
+    measure_font = ref_font if scalable else font
+    scale = size / base_size if scalable else 1.0
+
+    # تحضير النص العربي: Raqm و HarfBuzz يشكّلان النص المنطقي مباشرة
+    if engine in ("raqm", "harfbuzz"):
+        ar_text = AR_PREVIEW
+        ar_kwargs = {"direction": "rtl", "language": "ar"}
+    else:
+        from bidi.algorithm import get_display
+        reshaped_ar = arabic_reshaper.reshape(AR_PREVIEW)
+        ar_text = get_display(reshaped_ar)
+        ar_kwargs = {}
+    use_rtl = bool(ar_kwargs)
+
+    en_lines = wrap_text_to_lines(EN_PREVIEW, font, max_w, is_ar=False,
+                                  widths=measure_words(EN_PREVIEW, measure_font), scale=scale)
+    ar_lines = wrap_text_to_lines(ar_text, font, max_w, is_ar=use_rtl,
+                                  widths=measure_words(ar_text, measure_font, use_rtl), scale=scale)
+    en_fitted = _fit_lines(en_lines, font, max_w, {})
+    ar_fitted = _fit_lines(ar_lines, font, max_w, ar_kwargs)
+
+    spacing = int(size * 0.2)
+    placed = []
+
+    # رسم النص الإنجليزي في الربع العلوي
+    en_total_h = sum((b[3] - b[1]) + spacing for _, b in en_fitted) - spacing
+    y = max(px(20), (H//2 - en_total_h) // 2)
+    for ln, bbox in en_fitted:
+        x = (W - (bbox[2] - bbox[0])) / 2
+        placed.append((x, y, ln, font, {}))
+        y += (bbox[3] - bbox[1]) + spacing
+
+    # رسم النص العربي في الربع السفلي
+    ar_total_h = sum((b[3] - b[1]) + spacing for _, b in ar_fitted) - spacing
+    y = H//2 + max(px(20), (H//2 - ar_total_h) // 2)
+    y -= px(100)  # رفع النص العربي إلى الأعلى قليلاً (تقليل y بـ 100 بكسل)
+    for ln, bbox in ar_fitted:
+        x = (W - (bbox[2] - bbox[0])) / 2
+        placed.append((x, y, ln, font, ar_kwargs))
+        y += (bbox[3] - bbox[1]) + spacing
+    return placed
+
 # ---------- Preview creation (high resolution) ----------
-def create_preview(merged_ttf, out_jpg, bg_color="white", text_color="black"):
-    W, H = 6400, 2880  # دقة عالية
-    img = Image.new("RGB", (W, H), bg_color)
-    draw = ImageDraw.Draw(img)
+def render_preview_mask(merged_ttf, W, H):
+    """رسم نص المعاينة مرة واحدة في قناع تغطية (L) يُلوَّن لاحقاً لكل نمط"""
+    mask = Image.new("L", (W, H), 0)
+    draw = ImageDraw.Draw(mask)
+    for x, y, text, font, kwargs in layout_preview(merged_ttf, W, H):
+        _draw_preview_text(mask, draw, x, y, text, font, kwargs)
+    return mask
+
+def _blend_lut(bg, fg):
+    """جدول 256 قيمة لكل قناة بنفس تقريب Pillow في paste(color, mask)"""
+    lut = []
+    for a in range(256):
+        t = bg * (255 - a) + fg * a + 128
+        lut.append(((t >> 8) + t) >> 8)
+    return lut
+
+def compose_preview(mask, bg_color, text_color):
+    """تلوين قناع التغطية: نفس مزج draw.text للون النص فوق الخلفية
+    (mask.point بجدول لكل قناة أسرع من paste على الصورة كاملة)"""
+    bg = ImageColor.getrgb(bg_color) if isinstance(bg_color, str) else tuple(bg_color)
+    fg = ImageColor.getrgb(text_color) if isinstance(text_color, str) else tuple(text_color)
+    return Image.merge("RGB", [mask.point(_blend_lut(bg[i], fg[i])) for i in range(3)])
+
+# mask (1) + ثلاث قنوات point (3) + RGB مدمج (4) + بايتات RGBX (4) لكل بكسل في الشريحة
+_STRIPE_BYTES_PER_PIXEL = 12
+
+def render_preview_stripes(merged_ttf, W, H, stripe_h):
+    """رسم قناع المعاينة على شرائح أفقية بارتفاع stripe_h
+
+    Yields ``(top, mask)`` pairs. Each line is drawn only into the stripes
+    its bbox touches, at an integer offset, so the stripes concatenate to
+    exactly what ``render_preview_mask`` draws in one piece.
+    """
+    placed = []
+    for x, y, text, font, kwargs in layout_preview(merged_ttf, W, H):
+        bbox = font.getbbox(text, **kwargs)
+        placed.append((x, y, text, font, kwargs, y + bbox[1] - 1, y + bbox[3] + 1))
+    for top in range(0, H, stripe_h):
+        h = min(stripe_h, H - top)
+        mask = Image.new("L", (W, h), 0)
+        draw = ImageDraw.Draw(mask)
+        for x, y, text, font, kwargs, y0, y1 in placed:
+            if y1 > top and y0 < top + h:
+                _draw_preview_text(mask, draw, x, y - top, text, font, kwargs)
+        yield top, mask
+
+def _save_previews_striped(merged_ttf, outputs, profiles, W, H, limit):
+    """مسار الذاكرة المنخفضة: بكسلات الصورة النهائية في ملفات مؤقتة لا في الذاكرة
+
+    Only one stripe lives on the heap at a time. The text is laid out and
+    each mask stripe rasterized once; the stripe is then colored for every
+    theme and its RGBX rows appended to that theme's scratch file. Each file
+    is afterwards mapped read-only and handed to the encoder through
+    ``Image.frombuffer``, so full frames exist only as clean page cache the
+    kernel can drop under pressure. The price is ``W * H * 4`` bytes written
+    and read back per theme, so ``create_previews`` only takes this path
+    when the frames do not fit within the limit.
+    """
+    stripe_h = max(1, min(H, limit // (W * _STRIPE_BYTES_PER_PIXEL)))
+    frame_bytes = W * H * 4
+    with contextlib.ExitStack() as stack:
+        backings = [stack.enter_context(tempfile.TemporaryFile(dir=WORKER_TEMP_DIR or scratch_dir()))
+                    for _ in outputs]
+        for top, mask in render_preview_stripes(merged_ttf, W, H, stripe_h):
+            for backing, (_, bg_color, text_color) in zip(backings, outputs):
+                backing.write(compose_preview(mask, bg_color, text_color).tobytes("raw", "RGBX"))
+            del mask
+            report_progress("preview", min(top + stripe_h, H) * 100 // H)
+        for backing, (out_jpg, _, _) in zip(backings, outputs):
+            backing.flush()
+            mapped = mmap.mmap(backing.fileno(), frame_bytes, access=mmap.ACCESS_READ)
+            try:
+                if hasattr(mapped, "madvise"):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                img = Image.frombuffer("RGBX", (W, H), mapped, "raw", "RGBX", 0, 1)
+                save_preview_profiles(img, out_jpg, profiles)
+                del img
+            finally:
+                mapped.close()
+    write_log_line(f"Pillow: Rendered preview in {-(-H // stripe_h)} stripes of {stripe_h}px")
+
+def resolve_preview_themes(themes=None):
+    """تحويل أسماء الأنماط أو (اسم، خلفية، نص) إلى (خلفية، نص، لاحقة)"""
+    resolved = []
+    for theme in themes or DEFAULT_PREVIEW_THEMES:
+        if isinstance(theme, str):
+            resolved.append(PREVIEW_THEMES[theme])
+        else:
+            name, bg_color, text_color = theme
+            resolved.append((bg_color, text_color, f"_{name}"))
+    return resolved
 
+def resolve_preview_profiles(profiles=None):
+    """تحويل أسماء ملفات المعاينة (أو قواميس بنفس المفاتيح) إلى قائمة قواميس
+
+    WebP profiles fall back to progressive JPEG when Pillow was built
+    without libwebp.
+    """
+    resolved = []
+    for profile in profiles or DEFAULT_PREVIEW_PROFILES:
+        if isinstance(profile, str):
+            profile = dict(PREVIEW_PROFILES[profile], name=profile)
+        else:
+            profile = dict(profile)
+        profile["save"] = dict(profile.get("save") or {})
+        if profile["format"] == "WEBP" and not features.check_module("webp"):
+            write_log_line(f"[WARN] WebP not available, saving {profile.get('name', 'preview')} as progressive JPEG")
+            profile["format"] = "JPEG"
+            profile["save"]["progressive"] = True
+        resolved.append(profile)
+    return resolved
+
+def preview_profile_path(out_path, profile):
+    """مسار ملف المعاينة لملف تعريف معيّن: الاسم الأساسي + اللاحقة + امتداد الصيغة"""
+    return os.path.splitext(out_path)[0] + profile["suffix"] + PREVIEW_EXTENSIONS[profile["format"]]
+
+def preview_output_paths(outputs, profiles):
+    """كل الملفات التي ستنتجها create_previews لهذه المخرجات والملفات الشخصية"""
+    return [preview_profile_path(out_path, profile) for out_path, _, _ in outputs for profile in profiles]
+
+def _preview_render_size(profiles):
+    """حجم الرسم الوحيد: أكبر حجم بين الملفات المطلوبة"""
+    return max((tuple(p["size"]) for p in profiles), key=lambda size: size[0] * size[1])
+
+def _downscale_preview(img, size):
+    """تصغير: reduce() عند النسبة الصحيحة (مثل 6400 -> 1600) وإلا LANCZOS"""
+    factor = img.size[0] // size[0]
+    if factor >= 2 and img.size == (size[0] * factor, size[1] * factor):
+        return img.reduce(factor)
+    return img.resize(size, Image.LANCZOS, reducing_gap=2.0)
+
+def save_preview_profiles(frame, out_path, profiles):
+    """حفظ إطار واحد مرسوم بكل ملفات المعاينة
+
+    Profiles are written largest first and each smaller one is downscaled
+    from the previous image rather than from the full frame.
+    """
+    source = frame
+    for profile in sorted(profiles, key=lambda p: p["size"][0] * p["size"][1], reverse=True):
+        size = tuple(profile["size"])
+        img = source if size == source.size else _downscale_preview(source, size)
+        if profile["format"] != "JPEG" and img.mode != "RGB":
+            img = img.convert("RGB")
+        img.save(preview_profile_path(out_path, profile), profile["format"], **profile["save"])
+        source = img
+    del source
+
+def create_previews(merged_ttf, outputs, profiles=None):
+    """إنشاء عدة معاينات من رسم واحد للنص
+
+    ``outputs`` is a list of ``(out_path, bg_color, text_color)``. Layout and
+    text rasterization happen once, at the largest requested profile size;
+    every color scheme is composited from the same coverage mask and every
+    smaller profile is downscaled from that frame. When the full frames do
+    not fit within ``PREVIEW_MEMORY_LIMIT`` the mask is rendered in
+    stripes that do, at the cost of writing and reading back every frame
+    (see ``_save_previews_striped``). File names come from
+    ``preview_profile_path``.
+    """
+    profiles = resolve_preview_profiles(profiles)
+    W, H = _preview_render_size(profiles)
     try:
-        has_raqm = features.check_feature("raqm")
-        write_log_line(f"Pillow has Raqm support: {has_raqm}")
+        if PREVIEW_MEMORY_LIMIT and W * H * 4 * len(outputs) > PREVIEW_MEMORY_LIMIT:
+            _save_previews_striped(merged_ttf, outputs, profiles, W, H, PREVIEW_MEMORY_LIMIT)
+        else:
+            mask = render_preview_mask(merged_ttf, W, H)
+            for out_path, bg_color, text_color in outputs:
+                img = compose_preview(mask, bg_color, text_color)
+                save_preview_profiles(img, out_path, profiles)
+                del img
+        names = ", ".join(p.get("name", p["suffix"]) for p in profiles)
+        write_log_line(f"Pillow: Created preview x{len(outputs)} ({names})")
+        return True
+    except MergeCancelled:
+        raise
+    except Exception as ex:
+        write_log_line(f"[WARN] Preview creation failed: {ex}")
+    for out_path, bg_color, text_color in outputs:
+        _create_fallback_preview(out_path, W, H, bg_color, text_color, profiles)
+    return False
 
-        # حجم الخط الأساسي (تم تكبيره بنسبة 10%)
-        base_size = 330
+def _create_fallback_preview(out_jpg, W, H, bg_color, text_color, profiles=None):
+    try:
+        # النسخة الاحتياطية في حالة الفشل
+        img = Image.new("RGB", (W, H), bg_color)
+        draw = ImageDraw.Draw(img)
+        f_default = ImageFont.load_default()
+        draw.text((100, 500), EN_PREVIEW, font=f_default, fill=text_color)
 
-        # محاولة تحميل الخط المدمج
+        # Fallback للنص العربي
         try:
-            font_en = ImageFont.truetype(merged_ttf, base_size)
-            font_ar = ImageFont.truetype(merged_ttf, base_size)
-        except Exception:
-            # استخدام الخط الافتراضي إذا فشل التحميل
-            font_en = ImageFont.load_default()
-            font_ar = ImageFont.load_default()
+            draw.text((100, H//2 + 500), AR_PREVIEW, font=f_default, fill=text_color, direction="rtl", language="ar")
+        except:
+            from bidi.algorithm import get_display
+            reshaped_ar = arabic_reshaper.reshape(AR_PREVIEW)
+            bidi_ar = get_display(reshaped_ar)
+            draw.text((100, H//2 + 500), bidi_ar, font=f_default, fill=text_color)
 
-        # حساب عرض منطقة الالتفاف (~90% من العرض لملء الصورة)
-        max_w = int(W * 0.9)
+        if profiles:
+            save_preview_profiles(img, out_jpg, profiles)
+        else:
+            img.save(out_jpg, "JPEG", quality=95)
+        write_log_line("Pillow: Created fallback preview")
+        return True
+    except Exception as ex2:
+        write_log_line(f"[WARN] Fallback preview creation failed: {ex2}")
+        return False
 
-        # تكبير الخط حتى يصل إلى 85% من العرض
-        size = base_size
-        while True:
-            try:
-                font_en = ImageFont.truetype(merged_ttf, size)
-            except Exception:
-                font_en = ImageFont.load_default()
-            bbox = draw.textbbox((0,0), EN_PREVIEW, font=font_en)
-            w = bbox[2] - bbox[0]
-            if w >= W * 0.85 or size >= 1500:  # حد أقصى للحجم
+def create_preview(merged_ttf, out_jpg, bg_color="white", text_color="black", profiles=None):
+    return create_previews(merged_ttf, [(out_jpg, bg_color, text_color)], profiles)
+
+# ---------- Coverage planner ----------
+def _codepoints(spec):
+    return {cp for lo, hi in _unicode_ranges(spec) for cp in range(lo, hi + 1)}
+
+def plan_coverage(a_unicodes, e_unicodes, policy=None):
+    """توزيع كل نقطة ترميز على خط واحد فقط حسب سياسة الأولوية
+
+    ``a_unicodes``/``e_unicodes`` are the cmaps of the Arabic and English
+    fonts as range strings (``read_font_info()["unicodes"]``). Each rule
+    of ``policy`` (default ``COVERAGE_POLICY``) is ``(ranges, order)``: a
+    code point belongs to the first rule whose ranges contain it and goes to
+    the first font in that rule's order that maps it. Code points outside
+    every rule are left out. Returns ``{"arabic": ranges, "english":
+    ranges, "prepare": {"arabic": ranges, "english": ranges}, "report":
+    {...}}``. ``arabic``/``english`` are the exact sets each font keeps, so
+    the merge sees no duplicate code points. ``prepare`` holds every code
+    point the policy lets a font provide, which depends on that font's cmap
+    only: fonts are prepared (and cached) with it and trimmed to their
+    assigned set just before the merge (see ``trim_to_assigned``).
+    """
+    have = {"arabic": _codepoints(a_unicodes), "english": _codepoints(e_unicodes)}
+    assigned = {"arabic": set(), "english": set()}
+    candidates = {"arabic": set(), "english": set()}
+    rules = [(_codepoints(ranges), order) for ranges, order in (policy or COVERAGE_POLICY)]
+    outside = 0
+    for cp in have["arabic"] | have["english"]:
+        for scope, order in rules:
+            if cp in scope:
+                sides = [side for side in order if cp in have[side]]
+                for side in sides:
+                    candidates[side].add(cp)
+                if sides:
+                    assigned[sides[0]].add(cp)
                 break
-            size += 75  # زيادة أكبر للحصول على حجم أكبر
-
-        # صغر الحجم النهائي بنسبة 10%
-        size = int(size * 0.9)
-
-        # تحميل الخط بالحجم النهائي
-        try:
-            font_en = ImageFont.truetype(merged_ttf, size)
-            font_ar = ImageFont.truetype(merged_ttf, size)
-        except Exception:
-            font_en = ImageFont.load_default()
-            font_ar = ImageFont.load_default()
+        else:
+            outside += 1
+
+    overlap = have["arabic"] & have["english"]
+    both = assigned["arabic"] | assigned["english"]
+    report = {
+        side: {"cmap": len(have[side]), "assigned": len(assigned[side]),
+               "unused": len(have[side] - assigned[side])}
+        for side in ("arabic", "english")
+    }
+    report.update({
+        "overlap": len(overlap),
+        "overlap_to_arabic": len(overlap & assigned["arabic"]),
+        "overlap_to_english": len(overlap & assigned["english"]),
+        "outside_policy": outside,
+        "missing_arabic_letters": _format_unicode_ranges(set(_ARABIC_LETTERS) - both),
+        "missing_latin_letters": _format_unicode_ranges(set(_LATIN_LETTERS) - both),
+    })
+    write_log_line(f"Coverage: Arabic {len(assigned['arabic'])}/{len(have['arabic'])}, "
+                   f"English {len(assigned['english'])}/{len(have['english'])} code points; "
+                   f"{len(overlap)} shared ({report['overlap_to_arabic']} to Arabic, "
+                   f"{report['overlap_to_english']} to English), {outside} outside the policy")
+    for key in ("missing_arabic_letters", "missing_latin_letters"):
+        if report[key]:
+            write_log_line(f"[WARN] Coverage: {key.replace('_', ' ')}: {report[key]}")
+    return {"arabic": _format_unicode_ranges(assigned["arabic"]),
+            "english": _format_unicode_ranges(assigned["english"]),
+            "prepare": {side: _format_unicode_ranges(candidates[side]) for side in candidates},
+            "report": report}
+
+def trim_to_assigned(sources, prepared, assigned):
+    """قص كل مصدر حُضّر بنقاط أكثر مما أُسند إليه (نقاط مشتركة ذهبت للخط الآخر)
+
+    ``sources`` are prepared fonts (paths or bytes); ``prepared`` and
+    ``assigned`` are the range strings each was prepared with and keeps.
+    A source whose sets differ is subset again to its assigned set and
+    returned as bytes, so the glyphs of the dropped code points go too; the
+    others are returned unchanged.
+    """
+    trimmed = []
+    for src, have, keep in zip(sources, prepared, assigned):
+        if have != keep:
+            font = _open_merge_source(src)
+            try:
+                subset_font(font, keep)
+                buf = io.BytesIO()
+                font.save(buf)
+            finally:
+                font.close()
+            src = buf.getvalue()
+            write_log_line(f"Coverage: Trimmed {len(_codepoints(have)) - len(_codepoints(keep))} "
+                           "shared code points from a prepared font")
+        trimmed.append(src)
+    return trimmed
+
+def _font_unicodes(path, info=None):
+    """cmap الخط كنطاقات: من الفهرس إن وُجد، وإلا من الملف"""
+    if info and info.get("unicodes") is not None:
+        return info["unicodes"]
+    font = open_font_mapped(path, lazy=True)
+    try:
+        return _format_unicode_ranges(font.getBestCmap() or {})
+    finally:
+        font.close()
 
-        # تفصيل النص الإنجليزي إلى أسطر
-        en_lines = wrap_text_to_lines(EN_PREVIEW, font_en, max_w, is_ar=False, draw=draw)
+# ---------- Pre-flight check ----------
+# أقصى عدد حروف في خط OpenType (maxp.numGlyphs حقل 16 بت)
+MAX_GLYPHS = 65535
+_REQUIRED_TABLES = ("cmap", "head", "hhea", "hmtx", "maxp")
+_VARIATION_TABLES = ("gvar", "HVAR", "VVAR", "MVAR", "cvar", "avar", "STAT")
 
-        # تحضير النص العربي بناءً على دعم Raqm
-        if has_raqm:
-            ar_text = AR_PREVIEW
-            use_rtl = True
+def _preflight_font(path, unicodes):
+    """فحص خط واحد من فهرس الجداول وجداول صغيرة فقط (maxp، cmap، head، fvar)"""
+    font = open_font_mapped(path, lazy=True)
+    try:
+        sizes = {tag: font.reader.tables[tag].length for tag in font.reader.keys()}
+        if "glyf" in sizes and "loca" in sizes:
+            outline = "glyf"
+        elif "CFF2" in sizes:
+            outline = "CFF2"
+        elif "CFF " in sizes:
+            outline = "CFF"
         else:
-            reshaped_ar = arabic_reshaper.reshape(AR_PREVIEW)
-            ar_text = get_display(reshaped_ar)
-            use_rtl = False
-
-        # تفصيل النص العربي إلى أسطر
-        ar_lines = wrap_text_to_lines(ar_text, font_ar, max_w, is_ar=use_rtl, draw=draw)
-
-        # حساب ارتفاع النص العربي
-        spacing = int(size * 0.2)
-        ar_total_h = 0
-        for ln in ar_lines:
-            if use_rtl:
-                bbox = draw.textbbox((0,0), ln, font=font_ar, direction="rtl", language="ar")
-            else:
-                bbox = draw.textbbox((0,0), ln, font=font_ar)
-            ar_total_h += (bbox[3] - bbox[1]) + spacing
-        ar_total_h -= spacing  # إزالة التباعد الأخير
-
-        # حساب ارتفاع النص الإنجليزي
-        en_total_h = 0
-        for ln in en_lines:
-            bbox = draw.textbbox((0,0), ln, font=font_en)
-            en_total_h += (bbox[3] - bbox[1]) + spacing
-        en_total_h -= spacing  # إزالة التباعد الأخير
-
-        # رسم النص الإنجليزي في الربع العلوي
-        start_en_y = max(20, (H//2 - en_total_h) // 2)
-        y = start_en_y
-        for ln in en_lines:
-            bbox = draw.textbbox((0,0), ln, font=font_en)
-            w = bbox[2] - bbox[0]
-            x = (W - w) / 2
-            draw.text((x, y), ln, font=font_en, fill=text_color)
-            y += (bbox[3] - bbox[1]) + spacing
-
-        # رسم النص العربي في الربع السفلي
-        start_ar_y = H//2 + max(20, (H//2 - ar_total_h) // 2)
-        start_ar_y -= 100  # رفع النص العربي إلى الأعلى قليلاً (تقليل y بـ 100 بكسل)
-        y = start_ar_y
-        for ln in ar_lines:
-            if use_rtl:
-                bbox = draw.textbbox((0,0), ln, font=font_ar, direction="rtl", language="ar")
-                w = bbox[2] - bbox[0]
-                x = (W - w) / 2
-                draw.text((x, y), ln, font=font_ar, fill=text_color, direction="rtl", language="ar")
-            else:
-                bbox = draw.textbbox((0,0), ln, font=font_ar)
-                w = bbox[2] - bbox[0]
-                x = (W - w) / 2
-                draw.text((x, y), ln, font=font_ar, fill=text_color)
-            y += (bbox[3] - bbox[1]) + spacing
-
-        # حفظ الصورة بدقة عالية بصيغة JPEG
-        img.save(out_jpg, "JPEG", quality=95, dpi=(600, 600))
-        write_log_line(f"Pillow: Created high-quality preview")
-        return True
-    except Exception as ex:
-        write_log_line(f"[WARN] Preview creation failed: {ex}")
+            outline = None
+        num_glyphs = font["maxp"].numGlyphs if "maxp" in sizes else 0
+        cmap = (font.getBestCmap() or {}) if "cmap" in sizes else {}
+        wanted = _codepoints(unicodes)
+        mapped = {glyph for cp, glyph in cmap.items() if cp in wanted}
+        return {
+            "missing": [tag for tag in _REQUIRED_TABLES if tag not in sizes],
+            "outline": outline,
+            "glyphs": num_glyphs,
+            "mapped": len(mapped),
+            # حروف بلا ترميز (بدائل GSUB وما شابه): الحد الأعلى لما يضيفه إغلاق التقليص
+            "unencoded": max(0, num_glyphs - len(set(cmap.values())) - 1),
+            "units_per_em": font["head"].unitsPerEm if "head" in sizes else None,
+            "variable": "fvar" in sizes,
+            "bytes": sum(sizes.values()),
+            "variation_bytes": sum(sizes.get(tag, 0) for tag in _VARIATION_TABLES),
+        }
+    finally:
+        font.close()
+
+def preflight_merge(a_path, e_path, a_unicodes, e_unicodes):
+    """توقع نجاح الدمج وكلفة مراحله قبل تشغيل أي مرحلة مكلفة
+
+    Reads the table directory and the small ``maxp``/``cmap``/``head``/
+    ``fvar`` tables lazily (milliseconds). Returns a report with
+    ``errors`` (the merge cannot succeed: unreadable font, missing
+    required tables, no outlines, nothing to contribute, more than
+    ``MAX_GLYPHS`` glyphs even without layout closure), ``warnings``, the
+    predicted merged glyph count as ``[low, high]`` (high assumes the
+    subset keeps every unencoded glyph) and the work each stage will do.
+    """
+    report = {"errors": [], "warnings": [], "fonts": {}}
+    for side, path, unicodes in (("arabic", a_path, a_unicodes), ("english", e_path, e_unicodes)):
+        label = side.capitalize()
         try:
-            # النسخة الاحتياطية في حالة الفشل
-            f_default = ImageFont.load_default()
-            draw.text((100, 500), EN_PREVIEW, font=f_default, fill=text_color)
+            info = report["fonts"][side] = _preflight_font(path, unicodes)
+        except Exception as ex:
+            report["errors"].append(f"{label} font cannot be read: {ex}")
+            continue
+        if info["missing"]:
+            report["errors"].append(f"{label} font lacks required tables: {', '.join(info['missing'])}")
+        if info["outline"] is None:
+            report["errors"].append(f"{label} font has no glyf or CFF outlines")
+        if not info["mapped"]:
+            report["errors"].append(f"{label} font provides none of its assigned code points")
+    if len(report["fonts"]) < 2:
+        return report
+
+    fonts = report["fonts"]
+    # .notdef واحد في الناتج + الحروف المرمزة لكل خط (+ حروف بلا ترميز في أسوأ حالة)
+    low = 1 + sum(f["mapped"] for f in fonts.values())
+    high = low + sum(f["unencoded"] for f in fonts.values())
+    report["glyphs"] = [low, high]
+    if low > MAX_GLYPHS:
+        report["errors"].append(f"Merged font needs at least {low} glyphs (limit {MAX_GLYPHS})")
+    elif high > MAX_GLYPHS:
+        report["warnings"].append(f"Merged font may need up to {high} glyphs (limit {MAX_GLYPHS})")
+
+    target = max(f["units_per_em"] or 0 for f in fonts.values())
+    report["costs"] = {
+        "instance": {side: f["variation_bytes"] for side, f in fonts.items() if f["variable"]},
+        "convert": {side: f["glyphs"] for side, f in fonts.items() if f["outline"] in ("CFF", "CFF2")},
+        "subset": {side: f["bytes"] for side, f in fonts.items()},
+        "scale": {side: f["mapped"] + f["unencoded"] for side, f in fonts.items()
+                  if f["units_per_em"] != target},
+        "merge": high,
+    }
+    return report
+
+# ---------- Merge pipeline stages ----------
+# دوال مراحل مسار الملفات: على مستوى الوحدة ليمكن تشغيلها في عمليات فرعية
+def _stage_convert(path, label, work_dir):
+    try:
+        return convert_otf_to_ttf(path, [], out_dir=work_dir)
+    except Exception as ex:
+        write_log_line(f"خطأ أثناء تحويل {label}: {ex}")
+        return path
 
-            # Fallback للنص العربي
-            try:
-                draw.text((100, H//2 + 500), AR_PREVIEW, font=f_default, fill=text_color, direction="rtl", language="ar")
-            except:
-                reshaped_ar = arabic_reshaper.reshape(AR_PREVIEW)
-                bidi_ar = get_display(reshaped_ar)
-                draw.text((100, H//2 + 500), bidi_ar, font=f_default, fill=text_color)
+def _stage_subset(path, unicodes, work_dir):
+    try:
+        return subset_keep(path, unicodes, [], out_dir=work_dir)
+    except Exception as ex:
+        write_log_line(f"Subsetting error: {ex}")
+        return path
 
-            img.save(out_jpg, "JPEG", quality=95)
-            write_log_line(f"Pillow: Created fallback preview")
-            return False
-        except Exception as ex2:
-            write_log_line(f"[WARN] Fallback preview creation failed: {ex2}")
-            return False
+def _stage_scale(path, target, work_dir):
+    try:
+        return scale_font_file(path, target, out_dir=work_dir)
+    except Exception as ex:
+        write_log_line(f"Unify units error: {ex}")
+        return path
 
 # ---------- Main Merge Function ----------
-def main_merge(a_name, e_name):
+def main_merge(a_name, e_name, pipeline=None, themes=None, profiles=None, reuse=None, outputs=None,
+               instance=None):
+    """دمج خطين وإنشاء معايناته مع حفظ قياسات كل مرحلة (انظر RunMetrics)
+
+    With the merge catalog enabled, a request identical to a completed one
+    (same input files and options) returns immediately with the existing
+    outputs; ``reuse=False`` forces a new merge. When ``outputs`` is a dict
+    it receives the final ``font`` path, the ``woff2`` path (or None) and
+    the list of ``previews``. ``instance`` pins variable inputs before any
+    other stage (see ``resolve_instance_location``; default
+    ``VARIABLE_INSTANCE``).
+    """
+    init_runtime()
+    metrics = RunMetrics(a_name, e_name, pipeline or PIPELINE_MODE)
+    _METRICS_CONTEXT.metrics = metrics
+    _CACHE_CONTEXT.stats = metrics.cache
+    result = "Failed: Interrupted"
+    try:
+        result = _merge_pair(a_name, e_name, pipeline, themes, profiles, metrics, reuse, outputs, instance)
+        return result
+    finally:
+        _METRICS_CONTEXT.metrics = None
+        _CACHE_CONTEXT.stats = None
+        metrics.finish(result)
+        flush_log()
+
+def _merge_pair(a_name, e_name, pipeline, themes, profiles, metrics, reuse=None, outputs=None,
+                instance=None):
+    from rich.console import Console
+    from rich.progress import Progress, BarColumn, TextColumn, TimeRemainingColumn
     console = Console()
+    pipeline = pipeline or PIPELINE_MODE
+    instance = VARIABLE_INSTANCE if instance is None else instance
+    preview_themes = resolve_preview_themes(themes)
+    preview_profiles = resolve_preview_profiles(profiles)
+    started = time.perf_counter()
 
     # كتابة رأس السجل
     write_log_header()
 
     # إنشاء مجلد المعالجة المؤقتة
-    processing_dir = tempfile.mkdtemp(dir=TEMP_DIR)
+    processing_dir = tempfile.mkdtemp(dir=WORKER_TEMP_DIR or scratch_dir())
 
     try:
         write_log_line("=== بدء دمج الخطوط ===")
@@ -587,14 +3319,89 @@ def main_merge(a_name, e_name):
             write_log_line(f"[ERROR] الخط الإنجليزي غير موجود: {e_path}")
             return "Failed: English font not found"
 
-        # نسخ الملفات إلى المجلد المؤقت
-        a_temp = copy_to_temp(a_path, processing_dir)
-        e_temp = copy_to_temp(e_path, processing_dir)
+        # بيانات الخطين من الفهرس (لا يُفتح الملف إن لم يتغير منذ آخر فهرسة)
+        infos = {}
+        for label, path, script in (("Arabic", a_path, "arabic"), ("English", e_path, "latin")):
+            try:
+                info = infos[label] = font_info(path)
+            except Exception as ex:
+                write_log_line(f"[WARN] Font index: cannot read {os.path.basename(path)}: {ex}")
+                continue
+            write_log_line(f"{label} font: {info['family']} {info['style']}, {info['outline']}, "
+                           f"{info['units_per_em']} upem, {info['glyph_count']} glyphs, "
+                           f"{script} coverage {info[script + '_coverage']:.0%}")
+            if info[script + "_coverage"] < FONT_INDEX_MIN_COVERAGE:
+                write_log_line(f"[WARN] {label} font covers only {info[script + '_coverage']:.0%} "
+                               f"of the basic {script} letters")
+
+        # طلب مكرر: إعادة الناتج المسجل بدل تشغيل المراحل
+        catalog_key = previous = None
+        if MERGE_CATALOG_ENABLED:
+            catalog_key, a_sha, e_sha = merge_request_key(a_path, e_path, pipeline,
+                                                          preview_themes, preview_profiles, instance)
+            previous = lookup_merge(catalog_key)
+            if previous is not None and reuse is not False:
+                write_log_line(f"Catalog: Reused merge {catalog_key[:12]} -> {previous['font_path']}")
+                metrics.record["reused"] = catalog_key
+                print(f"{Fore.GREEN}✓ Successful (existing result)")
+                print(f"{Fore.BLUE}{previous['font_path']}")
+                previous_woff2 = (previous["options"] or {}).get("woff2")
+                if previous_woff2:
+                    print(f"{Fore.BLUE}{previous_woff2}")
+                for preview_path in previous["preview_paths"] or []:
+                    print(f"{Fore.BLUE}{preview_path}")
+                if outputs is not None:
+                    outputs.update(font=previous["font_path"], woff2=previous_woff2,
+                                   previews=list(previous["preview_paths"] or []))
+                report_progress("finish", 100, 100)
+                return "Success: Merge completed (existing result)"
+
+        # نقاط الترميز التي يقدمها كل خط (التثبيت لا يغيّر cmap، فتُحسب من الأصل)
+        # (التحضير بنقاط تعتمد على cmap الخط وحده، فيُعاد استخدامه مع أي خط آخر)
+        a_unicodes, e_unicodes = ARABIC_UNICODES, LATIN_UNICODES
+        a_prepare, e_prepare = a_unicodes, e_unicodes
+        if COVERAGE_MODE == "coverage":
+            plan = plan_coverage(_font_unicodes(a_path, infos.get("Arabic")),
+                                 _font_unicodes(e_path, infos.get("English")))
+            a_unicodes, e_unicodes = plan["arabic"], plan["english"]
+            a_prepare, e_prepare = plan["prepare"]["arabic"], plan["prepare"]["english"]
+            metrics.record["coverage"] = plan["report"]
+
+        # فحص مسبق: رفض الدمج المستحيل (أو إعادة تخطيطه) قبل أي مرحلة مكلفة
+        if PREFLIGHT_ENABLED:
+            with metrics.stage("preflight"):
+                check = preflight_merge(a_path, e_path, a_unicodes, e_unicodes)
+                if check.get("glyphs", [0])[0] > MAX_GLYPHS and COVERAGE_MODE == "coverage":
+                    write_log_line(f"[WARN] Pre-flight: {check['glyphs'][0]} glyphs over the limit, "
+                                   "re-planning with the basic ranges")
+                    a_unicodes, e_unicodes = ARABIC_UNICODES, LATIN_UNICODES
+                    a_prepare, e_prepare = a_unicodes, e_unicodes
+                    check = preflight_merge(a_path, e_path, a_unicodes, e_unicodes)
+                    check["replanned"] = True
+            metrics.record["preflight"] = check
+            for warning in check["warnings"]:
+                write_log_line(f"[WARN] Pre-flight: {warning}")
+            if check["errors"]:
+                for error in check["errors"]:
+                    write_log_line(f"[ERROR] Pre-flight: {error}")
+                print(f"{Fore.RED}✗ Failed")
+                print(f"{Fore.RED}{check['errors'][0]}")
+                return f"Failed: Pre-flight: {check['errors'][0]}"
+            costs = check["costs"]
+            write_log_line(f"Pre-flight: {check['glyphs'][0]}-{check['glyphs'][1]} glyphs expected; "
+                           f"instance {sorted(costs['instance']) or '-'}, convert {sorted(costs['convert']) or '-'}, "
+                           f"scale {sorted(costs['scale']) or '-'}")
+
+        # تثبيت الخطوط المتغيرة على موضع واحد قبل باقي المراحل
+        if any(infos.get(label, {"axes": True})["axes"] for label in ("Arabic", "English")):
+            with metrics.stage("instance"):
+                a_path = instantiate_font_file(a_path, instance, processing_dir)
+                e_path = instantiate_font_file(e_path, instance, processing_dir)
 
         temp_files = []
         steps = 8  # تم تقليل الخطوات بعد إزالة تحويل المتغير إلى ثابت
-        merged_path = None
-        preview_path = None
+        merged_path = woff2_path = None
+        preview_paths = []
 
         with Progress(
             TextColumn(" "),
@@ -605,95 +3412,162 @@ def main_merge(a_name, e_name):
             console=console
         ) as progress:
             task = progress.add_task("", total=steps)
+            done = 0
 
-            # 1 convert Arabic OTF/CFF->TTF
-            try:
-                a_ttf = convert_otf_to_ttf(a_temp, temp_files)
-            except Exception as ex:
-                write_log_line(f"خطأ أثناء تحويل عربي: {ex}")
-                a_ttf = a_temp
-            progress.update(task, advance=1)
-
-            # 2 convert English OTF/CFF->TTF
-            try:
-                e_ttf = convert_otf_to_ttf(e_temp, temp_files)
-            except Exception as ex:
-                write_log_line(f"خطأ أثناء تحويل إنجليزي: {ex}")
-                e_ttf = e_temp
-            progress.update(task, advance=1)
+            def advance(stage, n=1):
+                # شريط rich في الطرفية + تقدم المهمة (وفحص الإلغاء) لواجهة Android
+                nonlocal done
+                done += n
+                progress.update(task, advance=n)
+                report_progress(stage, 100, done * 100 // steps)
 
-            # 3 unify unitsPerEm
-            try:
-                a_ttf, e_ttf = try_unify_units([a_ttf, e_ttf])
-            except Exception as ex:
-                write_log_line(f"Unify units error: {ex}")
-            progress.update(task, advance=1)
-
-            # 4 subset to remove unwanted glyphs
-            try:
-                a_clean, e_clean = clean_languages(a_ttf, e_ttf, temp_files)
-            except Exception as ex:
-                write_log_line(f"Subsetting error: {ex}")
-                a_clean, e_clean = a_ttf, e_ttf
-            progress.update(task, advance=1)
-
-            # 5 merge with FontForge
             outname = os.path.splitext(os.path.basename(a_name))[0] + "_" + os.path.splitext(os.path.basename(e_name))[0] + ".ttf"
             outpath = unique_name(os.path.join(processing_dir, outname))
-            try:
-                merged_path = merge_fonts_with_fontforge([a_clean, e_clean], outpath)
-            except Exception as ex:
-                write_log_line(f"[ERROR] Merge failed: {ex}")
-                write_log_line(traceback.format_exc())
-                raise
-            progress.update(task, advance=1)
-
-            # 6 create preview JPG
-            preview_name = os.path.splitext(os.path.basename(merged_path))[0] + ".jpg"
-            preview_path = unique_name(os.path.join(processing_dir, preview_name))
-            create_preview(merged_path, preview_path)
-            progress.update(task, advance=1)
-
-            # 7 create 121212 preview JPG
-            preview_121212_name = os.path.splitext(os.path.basename(merged_path))[0] + "_121212.jpg"
-            preview_121212_path = unique_name(os.path.join(processing_dir, preview_121212_name))
-            create_preview(merged_path, preview_121212_path, bg_color=(18,18,18), text_color="white")
-            progress.update(task, advance=1)
-
-            # 8 finish
-            progress.update(task, completed=steps)
 
-        # نقل الملفات النهائية إلى المجلد الرئيسي
-        final_font_path = None
-        final_preview_path = None
-        final_preview_121212_path = None
+            if pipeline == "memory":
+                # 1-4 تحضير الخطين في الذاكرة (قراءة واحدة لكل خط)
+                with metrics.stage("prepare"):
+                    prepared = prepare_fonts_in_memory(
+                        [a_path, e_path], [a_prepare, e_prepare],
+                        processing_dir, temp_files,
+                        advance=lambda i: advance(("prepare_arabic", "prepare_english")[i], 2))
 
-        if merged_path and os.path.exists(merged_path):
-            final_font_path = unique_name(os.path.join(FONT_DIR, "merged", os.path.basename(merged_path)))
-            shutil.move(merged_path, final_font_path)
-
-        if preview_path and os.path.exists(preview_path):
-            final_preview_path = unique_name(os.path.join(FONT_DIR, "previews", os.path.basename(preview_path)))
-            shutil.move(preview_path, final_preview_path)
+                # 5 merge (الناتج النهائي فقط يُكتب على القرص)
+                with metrics.stage("merge"):
+                    try:
+                        prepared = trim_to_assigned(prepared, [a_prepare, e_prepare], [a_unicodes, e_unicodes])
+                        merged_path = merge_fonts(prepared, outpath, processing_dir)
+                    except Exception as ex:
+                        write_log_line(f"[ERROR] Merge failed: {ex}")
+                        write_log_line(traceback.format_exc())
+                        raise
+                advance("merge")
+            else:
+                with metrics.stage("prepare"):
+                    # 1-4 المدخلات تُقرأ من مكانها دون نسخ؛ كل خط في فرع مستقل: تحويل OTF/CFF->TTF ثم تقليص ثم توحيد unitsPerEm
+                    # (الوحدة الهدف تُقرأ مسبقاً، فلا يلتقي الفرعان إلا عند الدمج)
+                    target = max(infos[label]["units_per_em"] if label in infos else read_units_per_em(path)
+                                 for label, path in (("Arabic", a_path), ("English", e_path)))
+                    weights = {"convert": 1, "subset": 0.5, "scale": 0.5}
+                    scheduler = StageScheduler(
+                        on_done=lambda name: advance(name, weights[name.split("_")[0]]))
+                    cpu = _fonttools_stage_kind()
+                    for side, src, label, unicodes in (("arabic", a_path, "عربي", a_prepare),
+                                                       ("english", e_path, "إنجليزي", e_prepare)):
+                        scheduler.add(f"convert_{side}", _stage_convert, (src, label, processing_dir), kind=cpu)
+                        scheduler.add(f"subset_{side}", _stage_subset,
+                                      lambda r, side=side, unicodes=unicodes: (r[f"convert_{side}"], unicodes, processing_dir),
+                                      deps=(f"convert_{side}",), kind="process")
+                        scheduler.add(f"scale_{side}", _stage_scale,
+                                      lambda r, side=side: (r[f"subset_{side}"], target, processing_dir),
+                                      deps=(f"subset_{side}",), kind="process")
+                    results = scheduler.run()
+                    a_clean, e_clean = results["scale_arabic"], results["scale_english"]
+
+                # 5 merge (MERGE_ENGINE)
+                with metrics.stage("merge"):
+                    try:
+                        sources = trim_to_assigned([a_clean, e_clean], [a_prepare, e_prepare],
+                                                   [a_unicodes, e_unicodes])
+                        merged_path = merge_fonts(sources, outpath, processing_dir)
+                    except Exception as ex:
+                        write_log_line(f"[ERROR] Merge failed: {ex}")
+                        write_log_line(traceback.format_exc())
+                        raise
+                advance("merge")
+
+            # تحسين حجم الناتج قبل المعاينة، فتُرسم المعاينة من الخط المنشور نفسه
+            if OUTPUT_OPTIMIZE:
+                with metrics.stage("optimize"):
+                    try:
+                        woff2_path, metrics.record["optimize"] = optimize_font_file(merged_path, woff2=OUTPUT_WOFF2)
+                    except MergeCancelled:
+                        raise
+                    except Exception as ex:
+                        write_log_line(f"[WARN] Output optimization failed: {ex}")
+
+            # 6-7 create previews (themes x profiles) from a single text render
+            with metrics.stage("preview"):
+                merged_base = os.path.splitext(os.path.basename(merged_path))[0]
+                preview_outputs = []
+                for bg_color, text_color, suffix in preview_themes:
+                    path = unique_name(os.path.join(processing_dir, merged_base + suffix + ".jpg"))
+                    preview_outputs.append((path, bg_color, text_color))
+                create_previews(merged_path, preview_outputs, preview_profiles)
+                preview_paths = preview_output_paths(preview_outputs, preview_profiles)
+            advance("preview", 2)
 
-        if preview_121212_path and os.path.exists(preview_121212_path):
-            final_preview_121212_path = unique_name(os.path.join(FONT_DIR, "previews", os.path.basename(preview_121212_path)))
-            shutil.move(preview_121212_path, final_preview_121212_path)
+            # 8 finish
+            progress.update(task, completed=steps)
+            check_cancelled()
+
+        # نشر الملفات النهائية في المجلد الرئيسي (إعادة تسمية ذرية أو نسخة واحدة)
+        final_font_path = final_woff2_path = None
+        final_preview_paths = []
+
+        with metrics.stage("finish"):
+            if catalog_key is not None and merged_path and os.path.exists(merged_path):
+                # اسم واحد للخط ومعايناته، تُستبدل معاينات قديمة بنفس الاسم إن وُجدت
+                merged_base = os.path.splitext(os.path.basename(merged_path))[0]
+                if previous is not None:
+                    # إعادة دمج مقصودة (reuse=False): الناتج الجديد يحل محل القديم
+                    final_base = os.path.splitext(os.path.basename(previous["font_path"]))[0]
+                else:
+                    final_base = _catalog_output_base(merged_base, catalog_key)
+                final_font_path = os.path.join(FONT_DIR, "merged", final_base + ".ttf")
+                publish_file(merged_path, final_font_path)
+                if woff2_path:
+                    final_woff2_path = publish_file(woff2_path, os.path.join(FONT_DIR, "merged", final_base + ".woff2"))
+                for preview_path in preview_paths:
+                    if os.path.exists(preview_path):
+                        final_preview_path = os.path.join(
+                            FONT_DIR, "previews", final_base + os.path.basename(preview_path)[len(merged_base):])
+                        publish_file(preview_path, final_preview_path)
+                        final_preview_paths.append(final_preview_path)
+                stages = {s["name"]: s["wall"] for s in metrics.record["stages"] if s.get("wall") is not None}
+                try:
+                    record_merge(catalog_key, a_name, e_name, a_sha, e_sha,
+                                 {"pipeline": pipeline, "themes": preview_themes,
+                                  "profiles": [p.get("name") or p for p in preview_profiles],
+                                  "woff2": final_woff2_path},
+                                 final_font_path, final_preview_paths,
+                                 seconds=round(time.perf_counter() - started, 3), stages=stages)
+                except Exception as ex:
+                    write_log_line(f"[WARN] Catalog: recording merge failed: {ex}")
+            else:
+                if merged_path and os.path.exists(merged_path):
+                    final_font_path = unique_name(os.path.join(FONT_DIR, "merged", os.path.basename(merged_path)))
+                    publish_file(merged_path, final_font_path)
+                    if woff2_path:
+                        final_woff2_path = publish_file(woff2_path, os.path.splitext(final_font_path)[0] + ".woff2")
+
+                for preview_path in preview_paths:
+                    if os.path.exists(preview_path):
+                        final_preview_path = unique_name(os.path.join(FONT_DIR, "previews", os.path.basename(preview_path)))
+                        publish_file(preview_path, final_preview_path)
+                        final_preview_paths.append(final_preview_path)
 
         # عرض النتائج النهائية
         if final_font_path and os.path.exists(final_font_path):
             print(f"{Fore.GREEN}✓ Successful")
             print(f"{Fore.BLUE}{final_font_path}")
-            if final_preview_path and os.path.exists(final_preview_path):
+            if final_woff2_path:
+                print(f"{Fore.BLUE}{final_woff2_path}")
+            for final_preview_path in final_preview_paths:
                 print(f"{Fore.BLUE}{final_preview_path}")
-            if final_preview_121212_path and os.path.exists(final_preview_121212_path):
-                print(f"{Fore.BLUE}{final_preview_121212_path}")
+            if outputs is not None:
+                outputs.update(font=final_font_path, woff2=final_woff2_path, previews=final_preview_paths)
+            report_progress("finish", 100, 100)
             return "Success: Merge completed"
         else:
             print(f"{Fore.RED}✗ Failed")
             print(f"{Fore.RED}Merge operation failed")
             return "Failed: Merge operation failed"
 
+    except MergeCancelled as cancel_ex:
+        print(f"{Fore.YELLOW}✗ Cancelled")
+        write_log_line(f"[CANCELLED] {cancel_ex}")
+        return "Cancelled: Merge cancelled"
     except Exception as main_ex:
         print(f"{Fore.RED}✗ Failed")
         print(f"{Fore.RED}{str(main_ex)}")
@@ -701,8 +3575,307 @@ def main_merge(a_name, e_name):
         write_log_line(traceback.format_exc())
         return f"Failed: {str(main_ex)}"
     finally:
+        if CACHE_ENABLED:
+            write_log_line(f"Cache: {metrics.cache['hits']} hits, {metrics.cache['misses']} misses")
         # تنظيف المجلد المؤقت
         try:
             shutil.rmtree(processing_dir, ignore_errors=True)
         except:
             pass
+
+# ---------- Batch merge ----------
+def load_pairs_manifest(manifest_path):
+    """قراءة أزواج الخطوط (عربي، إنجليزي) من ملف
+
+    Accepts a JSON list of ``[arabic, english]`` pairs (or objects with
+    ``arabic``/``english`` keys), or a text file with one ``arabic,english``
+    pair per line. Blank lines and lines starting with ``#`` are ignored.
+    """
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        content = f.read()
+    pairs = []
+    if manifest_path.lower().endswith(".json"):
+        for item in json.loads(content):
+            if isinstance(item, dict):
+                pairs.append((item["arabic"], item["english"]))
+            else:
+                pairs.append((item[0], item[1]))
+        return pairs
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = [p.strip() for p in line.replace("\t", ",").split(",") if p.strip()]
+        if len(parts) != 2:
+            raise ValueError(f"Invalid manifest line: {line}")
+        pairs.append((parts[0], parts[1]))
+    return pairs
+
+def _batch_worker_init(batch_dir):
+    """تهيئة العامل: مجلد معالجة خاص تحت مجلد الدفعة، والمراحل على خيوط
+
+    The batch pool already keeps every core busy, so a stage pool per
+    worker would only start ``workers * STAGE_MAX_PROCESSES`` processes.
+    """
+    global WORKER_TEMP_DIR, STAGE_PROCESSES
+    WORKER_TEMP_DIR = tempfile.mkdtemp(prefix="worker_", dir=batch_dir)
+    STAGE_PROCESSES = False
+
+def _batch_process_init(batch_dir):
+    # عملية في مجمّع الدفعة (لا المسار التسلسلي الذي يعمل في العملية الرئيسية)
+    _pool_worker_init()
+    _batch_worker_init(batch_dir)
+
+def _restore_worker_state(temp_dir, stage_processes):
+    global WORKER_TEMP_DIR, STAGE_PROCESSES
+    WORKER_TEMP_DIR = temp_dir
+    STAGE_PROCESSES = stage_processes
+
+def _batch_merge_one(a_name, e_name):
+    # العمال يكتبون في السجل نفسه؛ كل سجل يحمل pid العامل
+    started = time.time()
+    try:
+        result = main_merge(a_name, e_name)
+    except Exception as ex:
+        result = f"Failed: {ex}"
+    return a_name, e_name, result, time.time() - started
+
+def batch_merge(pairs, workers=None):
+    """دمج عدة أزواج من الخطوط بالتوازي
+
+    ``pairs`` is a list of ``(arabic, english)`` names or the path of a
+    manifest file (see ``load_pairs_manifest``). Runs the pairs on a process
+    pool with one processing dir per worker under ``scratch_dir()`` and yields
+    ``(arabic, english, result, seconds)`` for each pair as soon as it
+    finishes, in completion order.
+    """
+    if isinstance(pairs, str):
+        pairs = load_pairs_manifest(pairs)
+    pairs = [(a, e) for a, e in pairs]
+    if not pairs:
+        return
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(pairs)))
+
+    init_runtime()
+    batch_dir = tempfile.mkdtemp(prefix="batch_", dir=scratch_dir())
+    try:
+        try:
+            executor = ProcessPoolExecutor(max_workers=workers,
+                                           mp_context=_pool_context(),
+                                           initializer=_batch_process_init,
+                                           initargs=(batch_dir,))
+        except (ImportError, NotImplementedError, OSError) as ex:
+            # بعض البيئات (مثل Chaquopy) لا تدعم multiprocessing
+            write_log_line(f"[WARN] Process pool unavailable ({ex}), running batch serially")
+            executor = None
+
+        if executor is None:
+            # العامل هنا هو العملية نفسها: تُعاد حالتها السابقة قبل حذف مجلد الدفعة
+            saved_state = (WORKER_TEMP_DIR, STAGE_PROCESSES)
+            _batch_worker_init(batch_dir)
+            try:
+                for a_name, e_name in pairs:
+                    yield _batch_merge_one(a_name, e_name)
+            finally:
+                _restore_worker_state(*saved_state)
+            return
+
+        with executor:
+            futures = {executor.submit(_batch_merge_one, a, e): (a, e) for a, e in pairs}
+            for fut in as_completed(futures):
+                a_name, e_name = futures[fut]
+                try:
+                    yield fut.result()
+                except Exception as ex:
+                    # عامل انهار (مثلاً بسبب نفاد الذاكرة)
+                    yield a_name, e_name, f"Failed: {ex}", 0.0
+    finally:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+
+# ---------- Fan-out merge ----------
+def fanout_merge(a_name, e_names, themes=None, profiles=None, reuse=None, instance=None):
+    """دمج خط عربي واحد مع عدة خطوط إنجليزية، مع تحضير الخط العربي مرة واحدة
+
+    Runs ``main_merge`` for each English font in turn with the "memory"
+    pipeline, in this process, so the prepared Arabic font is kept in the
+    in-process cache (``PREPARED_MEMORY_MAX_BYTES``). It is prepared from
+    its own cmap (see ``plan_coverage``), so it is only prepared again
+    when an English font needs a different unitsPerEm or the cache evicts
+    it. All the merges share one stage process pool (``get_stage_pool``),
+    so no pool is started per English font. Yields
+    ``(arabic, english, result, seconds, outputs)`` as each merge finishes,
+    where ``outputs`` holds the final ``font`` path, ``woff2`` and ``previews``.
+    """
+    if isinstance(e_names, str):
+        e_names = [e_names]
+    init_runtime()
+    write_log_line(f"Fan-out: {a_name} against {len(e_names)} English fonts")
+    for e_name in e_names:
+        started = time.time()
+        outputs = {"font": None, "woff2": None, "previews": []}
+        try:
+            result = main_merge(a_name, e_name, pipeline="memory", themes=themes,
+                                profiles=profiles, reuse=reuse, outputs=outputs, instance=instance)
+        except Exception as ex:
+            result = f"Failed: {ex}"
+        yield a_name, e_name, result, time.time() - started, outputs
+
+# ---------- Merge jobs (Android API) ----------
+# عدد المهام المنتهية التي تبقى حالتها متاحة للاستعلام
+JOBS_KEEP_FINISHED = 32
+
+_JOBS = {}
+_JOBS_LOCK = threading.Lock()
+
+class MergeJob:
+    """مهمة دمج تعمل في خيط مستقل مع حالة وتقدم وإلغاء
+
+    ``status`` is one of ``queued``, ``running``, ``done``, ``failed`` or
+    ``cancelled``. Progress callbacks receive the ``snapshot()`` dict on
+    the job's thread; exceptions they raise are logged and ignored.
+    """
+
+    def __init__(self, a_name, e_name, options):
+        self.id = uuid.uuid4().hex
+        self.a_name = a_name
+        self.e_name = e_name
+        self.options = options
+        self.status = "queued"
+        self.stage = None
+        self.stage_percent = 0
+        self.percent = 0
+        self.result = None
+        self.created = time.time()
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.thread = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "id": self.id, "arabic": self.a_name, "english": self.e_name,
+                "status": self.status, "stage": self.stage,
+                "stage_percent": self.stage_percent, "percent": self.percent,
+                "result": self.result, "cancel_requested": self.cancel_event.is_set(),
+                "elapsed": (self.finished or time.time()) - self.created,
+            }
+
+    def add_callback(self, callback):
+        with self._lock:
+            self._callbacks.append(callback)
+        self._notify([callback])
+
+    def update_progress(self, stage, stage_percent, percent=None):
+        with self._lock:
+            self.stage = stage
+            self.stage_percent = min(100, int(stage_percent))
+            if percent is not None:
+                self.percent = min(100, int(percent))
+        self._notify()
+
+    def _set_status(self, status, result=None):
+        with self._lock:
+            self.status = status
+            if result is not None:
+                self.result = result
+            if status in ("done", "failed", "cancelled"):
+                self.finished = time.time()
+        self._notify()
+
+    def _notify(self, callbacks=None):
+        if callbacks is None:
+            with self._lock:
+                callbacks = list(self._callbacks)
+        if not callbacks:
+            return
+        state = self.snapshot()
+        for callback in callbacks:
+            try:
+                callback(state)
+            except Exception as ex:
+                write_log_line(f"[WARN] Progress callback failed for job {self.id}: {ex}")
+
+def _run_job(job):
+    _JOB_CONTEXT.job = job
+    try:
+        if job.cancel_event.is_set():
+            job._set_status("cancelled", "Cancelled: Merge cancelled")
+            return
+        job._set_status("running")
+        try:
+            result = main_merge(job.a_name, job.e_name, **job.options)
+        except Exception as ex:
+            result = f"Failed: {ex}"
+        if job.cancel_event.is_set() or result.startswith("Cancelled"):
+            job._set_status("cancelled", result)
+        elif result.startswith("Success"):
+            job._set_status("done", result)
+        else:
+            job._set_status("failed", result)
+    finally:
+        _JOB_CONTEXT.job = None
+
+def _prune_jobs():
+    finished = sorted((j for j in _JOBS.values() if j.finished), key=lambda j: j.finished)
+    for job in finished[:max(0, len(finished) - JOBS_KEEP_FINISHED)]:
+        del _JOBS[job.id]
+
+def submit_merge(a_name, e_name, callback=None, **options):
+    """بدء دمج في الخلفية وإرجاع معرّف المهمة فوراً
+
+    ``options`` are passed to ``main_merge`` (``pipeline``, ``themes``,
+    ``profiles``, ``instance``...). ``callback`` is registered with ``add_progress_callback``
+    before the job starts.
+    """
+    job = MergeJob(a_name, e_name, options)
+    if callback is not None:
+        job._callbacks.append(callback)
+    with _JOBS_LOCK:
+        _prune_jobs()
+        _JOBS[job.id] = job
+    job.thread = threading.Thread(target=_run_job, args=(job,), name=f"merge-{job.id[:8]}", daemon=True)
+    job.thread.start()
+    write_log_line(f"Job {job.id}: submitted {a_name} + {e_name}")
+    return job.id
+
+def _get_job(job_id):
+    with _JOBS_LOCK:
+        job = _JOBS.get(job_id)
+    if job is None:
+        raise KeyError(f"Unknown merge job: {job_id}")
+    return job
+
+def get_job_status(job_id):
+    """حالة المهمة كقاموس (انظر MergeJob.snapshot)"""
+    return _get_job(job_id).snapshot()
+
+def add_progress_callback(job_id, callback):
+    """تسجيل دالة تُستدعى بحالة المهمة عند كل تقدم (وفوراً بالحالة الحالية)"""
+    _get_job(job_id).add_callback(callback)
+
+def cancel_job(job_id):
+    """طلب إلغاء المهمة؛ تتوقف عند أقرب نقطة فحص وتُنهى عمليات FontForge التابعة لها
+
+    Returns ``False`` if the job had already finished.
+    """
+    job = _get_job(job_id)
+    if job.finished:
+        return False
+    job.cancel_event.set()
+    write_log_line(f"Job {job.id}: cancel requested")
+    return True
+
+def wait_job(job_id, timeout=None):
+    """انتظار انتهاء المهمة وإرجاع حالتها"""
+    job = _get_job(job_id)
+    if job.thread is not None:
+        job.thread.join(timeout)
+    return job.snapshot()
+
+def merge_fonts_android(a_name, e_name):
+    """نقطة الدخول المتزامنة القديمة لـ MainActivity: دمج عبر مهمة وانتظار النتيجة"""
+    return wait_job(submit_merge(a_name, e_name))["result"]